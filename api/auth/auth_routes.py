@@ -1,10 +1,11 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from datetime import timedelta
 from typing import Annotated
 
-from .security import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES #, JWT_SECRET_KEY, JWT_ALGORITHM (these will be loaded from main config)
-from ...models import Token, User, UserInDB, get_user_from_db # Adjusted import path for models
+from . import security
+from .security import verify_and_update_password, create_access_token #, JWT_SECRET_KEY, JWT_ALGORITHM (these will be loaded from main config)
+from ..models import Token, User, UserInDB, get_user_from_db, update_user_password_hash # Adjusted import path for models
 # from ...main import API_CONFIG # If JWT settings are needed directly here, though better from security.py
 
 router = APIRouter()
@@ -12,19 +13,28 @@ router = APIRouter()
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     user_in_db = get_user_from_db(form_data.username)
-    if not user_in_db or not verify_password(form_data.password, user_in_db.hashed_password):
+    # Always run bcrypt, against a dummy hash for unknown users, so response time
+    # does not reveal whether the username exists.
+    hashed_password = user_in_db.hashed_password if user_in_db else security.DUMMY_PASSWORD_HASH
+    # bcrypt is CPU-bound but releases the GIL, so run it on a worker thread
+    # instead of stalling every other coroutine on the event loop.
+    is_valid, new_hash = await asyncio.to_thread(verify_and_update_password, form_data.password, hashed_password)
+    if not (user_in_db is not None) & is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Stored hash uses an outdated cost factor; persist the re-hashed value
+        update_user_password_hash(user_in_db.username, new_hash)
+        # The highest stored cost may have dropped; keep unknown-user logins matching it
+        await asyncio.to_thread(security.refresh_dummy_password_hash)
     if user_in_db.disabled:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
     
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES) # This should use the configured value
-    access_token = create_access_token(
-        data={"sub": user_in_db.username}, expires_delta=access_token_expires
-    )
+    # No expires_delta: create_access_token applies the configured default lifetime
+    access_token = create_access_token(data={"sub": user_in_db.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # Example of a protected route that could be in this router or elsewhere
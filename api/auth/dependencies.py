@@ -1,10 +1,9 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError
 from typing import Annotated, Optional
 
 from .security import decode_access_token #, JWT_SECRET_KEY, JWT_ALGORITHM (should be loaded from main config)
-from ...models import TokenData, User, UserInDB, get_user_from_db # Adjusted import path
+from ..models import TokenData, User, UserInDB, get_user_from_db, get_public_user # Adjusted import path
 # from ...main import API_CONFIG # To get JWT settings
 
 # This will require clients to send a token with "Bearer " prefix in Authorization header
@@ -35,7 +34,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> Use
 async def get_current_active_user(current_user: Annotated[UserInDB, Depends(get_current_user)]) -> User:
     if current_user.disabled:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user")
-    return User(**current_user.model_dump()) # Return as User model (without hashed_password)
+    return get_public_user(current_user) # User model without hashed_password, no re-validation
 
 # Example of a dependency for role-based access (if you add roles to User model)
 # def require_role(required_role: str):
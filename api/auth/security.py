@@ -1,45 +1,146 @@
-from datetime import datetime, timedelta, timezone
-from typing import Optional, Union, Any
+import logging
+import math
+import time
+from datetime import timedelta
+from functools import lru_cache
+from typing import Optional, Union, Any, Tuple
 
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+import bcrypt
+import jwt
+
+from ..models import FAKE_USERS_DB
 
 # Configuration (ideally loaded from main app config or environment variables)
 # These would be set from API_CONFIG.get('jwt', {})
 JWT_SECRET_KEY = "your-very-secret-key-please-change-in-production" # Placeholder, load from config
 JWT_ALGORITHM = "HS256"  # Placeholder, load from config
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 # Placeholder, load from config
+_DEFAULT_EXPIRE_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60 # Kept in sync by configure_jwt
+# bcrypt work factor. 12 is ~250ms per verify; 10 is ~4x cheaper and still a
+# reasonable cost for this deployment. Overridden from API_CONFIG['auth'].
+BCRYPT_ROUNDS = 10
+# bcrypt only uses the first 72 bytes of a password (passlib truncated silently too)
+BCRYPT_MAX_PASSWORD_BYTES = 72
+_BCRYPT_IDENT = "$2b$"
+# $2a$/$2y$ are older idents for the same algorithm; they verify the same way as $2b$
+_LEGACY_BCRYPT_IDENTS = ("$2a$", "$2y$")
+
+logger = logging.getLogger(__name__)
+
+
+def configure_jwt(jwt_config: dict) -> None:
+    """Apply the 'jwt' section of the API config and invalidate previously decoded tokens."""
+    global JWT_SECRET_KEY, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, _DEFAULT_EXPIRE_SECONDS
+    JWT_SECRET_KEY = jwt_config.get('secret_key', JWT_SECRET_KEY)
+    JWT_ALGORITHM = jwt_config.get('algorithm', JWT_ALGORITHM)
+    ACCESS_TOKEN_EXPIRE_MINUTES = jwt_config.get('access_token_expire_minutes', ACCESS_TOKEN_EXPIRE_MINUTES)
+    _DEFAULT_EXPIRE_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    clear_token_cache()
+
+
+def configure_password_hashing(auth_config: dict) -> None:
+    """Apply the 'auth' section of the API config to the password hashing settings."""
+    global BCRYPT_ROUNDS
+    BCRYPT_ROUNDS = int(auth_config.get('bcrypt_rounds', BCRYPT_ROUNDS))
+    refresh_dummy_password_hash()
+
+
+def _encode_password(password: str) -> bytes:
+    return password.encode("utf-8")[:BCRYPT_MAX_PASSWORD_BYTES]
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _hash_cost(hashed_password: str) -> Optional[int]:
+    # bcrypt hashes look like $2b$<cost>$<salt+digest>
+    if not hashed_password.startswith((_BCRYPT_IDENT,) + _LEGACY_BCRYPT_IDENTS):
+        return None
+    try:
+        return int(hashed_password[4:6])
+    except ValueError:
+        return None
+
+
+def _needs_rehash(hashed_password: str) -> bool:
+    return not hashed_password.startswith(_BCRYPT_IDENT) or _hash_cost(hashed_password) != BCRYPT_ROUNDS
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    if hashed_password.startswith(_LEGACY_BCRYPT_IDENTS):
+        hashed_password = _BCRYPT_IDENT + hashed_password[4:]
+    elif not hashed_password.startswith(_BCRYPT_IDENT):
+        logger.warning("Unsupported password hash format; rejecting credentials.")
+        return False
+    try:
+        return bcrypt.checkpw(_encode_password(plain_password), hashed_password.encode("ascii"))
+    except ValueError: # Malformed hash
+        return False
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password and return (is_valid, new_hash). new_hash is set when the stored hash should be replaced."""
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    if _needs_rehash(hashed_password):
+        return True, get_password_hash(plain_password)
+    return True, None
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(_encode_password(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS, prefix=b"2b")).decode("ascii")
+
+
+# Verified against when the username is unknown, so a failed login costs the same
+# bcrypt work whether or not the user exists (no username enumeration via timing).
+DUMMY_PASSWORD_HASH = ""
+
+
+def _dummy_hash_rounds() -> int:
+    # Stored hashes keep their cost until the user logs in and is re-hashed at
+    # BCRYPT_ROUNDS, so match the most expensive of them
+    costs = [_hash_cost(user["hashed_password"]) for user in FAKE_USERS_DB.values()]
+    return max([BCRYPT_ROUNDS] + [cost for cost in costs if cost])
+
+
+def refresh_dummy_password_hash() -> None:
+    """Rebuild DUMMY_PASSWORD_HASH if the cost it should have changed (config or re-hashed users)."""
+    global DUMMY_PASSWORD_HASH
+    rounds = _dummy_hash_rounds()
+    if _hash_cost(DUMMY_PASSWORD_HASH) != rounds:
+        DUMMY_PASSWORD_HASH = bcrypt.hashpw(_encode_password("dummy-password"),
+                                            bcrypt.gensalt(rounds=rounds, prefix=b"2b")).decode("ascii")
+
+
+refresh_dummy_password_hash()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    lifetime_seconds = expires_delta.total_seconds() if expires_delta else _DEFAULT_EXPIRE_SECONDS
+    # 'exp' is a NumericDate (epoch seconds), so compute it directly from time.time()
+    to_encode["exp"] = int(time.time() + lifetime_seconds)
     # Ensure JWT_SECRET_KEY and JWT_ALGORITHM are properly loaded from config in a real app
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 
+@lru_cache(maxsize=4096)
+def _decode_cached(token: str) -> Tuple[dict, float]:
+    # Raises jwt.PyJWTError for invalid tokens; exceptions are not cached.
+    payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    return payload, float(payload.get("exp", math.inf))
+
+
+def clear_token_cache() -> None:
+    """Drop cached token payloads, e.g. after the signing key or algorithm changed."""
+    _decode_cached.cache_clear()
+
+
 def decode_access_token(token: str) -> Optional[dict]:
+    # Clients re-send the same token on every request, so the base64/JSON/HMAC work is
+    # cached per token. Expiry is re-checked here because cached entries outlive 'exp'.
     try:
-        # Ensure JWT_SECRET_KEY and JWT_ALGORITHM are properly loaded from config
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        return payload
-    except JWTError:
+        payload, exp_ts = _decode_cached(token)
+    except jwt.PyJWTError:
         return None
-
-# This function will be more fleshed out in dependencies.py for actual user loading
-# For now, it's a helper for token decoding. 
\ No newline at end of file
+    if time.time() >= exp_ts:
+        return None
+    return payload
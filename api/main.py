@@ -1,13 +1,17 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
 import logging
+import re
 import yaml
-import json
-from datetime import datetime, timedelta # Ensure timedelta is imported for security module updates
+from typing import Optional, Annotated
+import orjson
+from datetime import datetime
 
-from .models import RealTimeDataUpdate, User # Import User for protected endpoints
-from .services.mqtt_service import MQTTService
+from .models import User # Import User for protected endpoints
+from .services.mqtt_service import MQTTConsumerPool
 from .routes import data_routes, control_routes
 from .auth import auth_routes # Import auth_routes
 from .auth import security as auth_security # To update JWT settings
@@ -18,26 +22,29 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 API_CONFIG = {}
-MQTT_SERVICE_INSTANCE: Optional[MQTTService] = None
-# _influx_service_instance from data_routes should be managed there or via a proper DI system
-# For now, lifespan closing it is a temporary measure if it was made global in data_routes.
-# It is better if InfluxDBService is instantiated per request or managed by a DI container.
+MQTT_SERVICE_INSTANCE: Optional[MQTTConsumerPool] = None
+# The InfluxDB service is a process-wide singleton created lazily by data_routes.get_influx_service
+# and closed once from lifespan shutdown.
 
 
+# libyaml's C parser when PyYAML was built with it; same safe semantics as yaml.safe_load
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 def load_api_config_and_jwt_settings(config_file="config.yaml"):
     global API_CONFIG
     try:
         with open(config_file, 'r') as f:
-            API_CONFIG = yaml.safe_load(f)
+            API_CONFIG = yaml.load(f, Loader=_YAML_LOADER)
         logger.info(f"API configuration loaded from {config_file}")
 
         # Update JWT settings in security module
-        jwt_config = API_CONFIG.get('jwt', {})
-        auth_security.JWT_SECRET_KEY = jwt_config.get('secret_key', auth_security.JWT_SECRET_KEY)
-        auth_security.JWT_ALGORITHM = jwt_config.get('algorithm', auth_security.JWT_ALGORITHM)
-        auth_security.ACCESS_TOKEN_EXPIRE_MINUTES = jwt_config.get('access_token_expire_minutes', auth_security.ACCESS_TOKEN_EXPIRE_MINUTES)
+        auth_security.configure_jwt(API_CONFIG.get('jwt', {}))
         logger.info(f"JWT Settings: Loaded Secret Key (ending): ...{auth_security.JWT_SECRET_KEY[-6:] if len(auth_security.JWT_SECRET_KEY) > 5 else ''}, Algorithm: {auth_security.JWT_ALGORITHM}, Token Expire Minutes: {auth_security.ACCESS_TOKEN_EXPIRE_MINUTES}")
 
+        # Password hashing settings (bcrypt cost factor)
+        auth_security.configure_password_hashing(API_CONFIG.get('auth', {}))
+        logger.info(f"Password hashing: bcrypt rounds = {auth_security.BCRYPT_ROUNDS}")
+
     except FileNotFoundError:
         logger.warning(f"API configuration file {config_file} not found. Using default JWT settings.")
         API_CONFIG = {}
@@ -53,16 +60,17 @@ def load_api_config_and_jwt_settings(config_file="config.yaml"):
 # --- WebSocket Connection Manager ---
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: list[WebSocket] = []
+        # A set makes disconnect O(1); broadcast order does not matter
+        self.active_connections: set[WebSocket] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
         logger.info(f"WebSocket connection established: {websocket.client}")
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+            self.active_connections.discard(websocket)
             logger.info(f"WebSocket connection closed: {websocket.client}")
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
@@ -70,94 +78,89 @@ class ConnectionManager:
 
     async def broadcast(self, message: str):
         # logger.debug(f"Broadcasting to {len(self.active_connections)} WebSocket clients: {message}")
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Error sending message to WebSocket client {connection.client}: {e}")
-                # Optionally disconnect problematic clients
-                # self.disconnect(connection) 
+        # Send to all clients concurrently rather than one round-trip after another.
+        # Snapshot the list: clients may connect/disconnect while the sends are in flight.
+        connections = list(self.active_connections)
+        # Encode once and send binary frames; send_text would re-encode the same string per client.
+        payload = message.encode('utf-8')
+        results = await asyncio.gather(*(connection.send_bytes(payload) for connection in connections), return_exceptions=True)
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error sending message to WebSocket client {connection.client}: {result}")
+                self.disconnect(connection)
 
 manager = ConnectionManager()
 
 # --- MQTT Message Handler for WebSockets ---
-# Placeholder for proper async task scheduling for manager.broadcast
-async def schedule_broadcast(message: str):
-    await manager.broadcast(message)
+# MQTTService delivers messages on the event loop; updates are queued (set up in lifespan)
+# and broadcast from a single consumer task.
+WS_QUEUE_MAXSIZE = 10_000
+WS_MAX_BATCH_SIZE = 64 # Updates per WebSocket frame
+WS_QUEUE: Optional["asyncio.Queue[str]"] = None
+
+def _enqueue_ws_message(message: str):
+    try:
+        WS_QUEUE.put_nowait(message)
+    except asyncio.QueueFull:
+        logger.warning("WebSocket broadcast queue is full; dropping real-time update.")
+
+async def _ws_broadcast_consumer(queue: "asyncio.Queue[str]"):
+    # Each frame is a JSON array of updates: whatever has queued up (bounded) is sent
+    # together, so bursts of register updates cost one frame per client, not one each.
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < WS_MAX_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        try:
+            # Items are already-serialized JSON objects; join rather than re-serialize
+            await manager.broadcast("[" + ",".join(batch) + "]")
+        except Exception as e:
+            logger.error(f"Error broadcasting real-time update: {e}", exc_info=True)
+
+# Trailing device_name/slave_id/register_type/address segments of a gateway data topic.
+# Matching these directly avoids allocating a list per message with topic.split('/').
+_DATA_TOPIC_RE = re.compile(r'/([^/]+)/([^/]+)/([^/]+)/([^/]+)$')
+# Boolean payloads as published by the gateway (lowercase) plus Python's str(bool) form.
+# A dict lookup on the raw payload resolves the value without calling payload.lower().
+_BOOL_PAYLOADS = {'true': True, 'True': True, 'false': False, 'False': False}
+_NOT_BOOL = object()
 
 def handle_mqtt_for_websockets(topic: str, payload: str):
     logger.debug(f"MQTT Handler for WS: Topic: {topic}, Payload: {payload}")
     # Expected topic format from gateway: prefix/device_name/slave_id/register_type/address
     # e.g., modbus/gateway/SimulatedDevice1/1/holding_registers/0
     try:
-        parts = topic.split('/')
-        if len(parts) >= 5: # Basic validation of topic structure
-            # prefix = parts[0]
-            # gateway_identifier = parts[1] # e.g., 'gateway' if included by gateway config
-            device_name = parts[-4] # Adjust indices based on actual topic structure from gateway
-            slave_id = parts[-3]
-            register_type = parts[-2]
-            address = parts[-1]
-
-            # Attempt to convert payload to a more specific type if possible
-            try:
-                # Check if it's a boolean string
-                if payload.lower() == 'true': processed_value = True
-                elif payload.lower() == 'false': processed_value = False
-                else: # Try to convert to float, then int
+        match = _DATA_TOPIC_RE.search(topic)
+        if match: # At least one prefix level plus the four trailing segments
+            device_name, slave_id, register_type, address = match.groups()
+
+            # Decide the type from the payload's shape instead of trying conversions in turn:
+            # each failed conversion raises (and allocates) a ValueError.
+            processed_value = _BOOL_PAYLOADS.get(payload, _NOT_BOOL)
+            if processed_value is _NOT_BOOL:
+                # At most one leading sign: lstrip('-') would let "--5" through to int()
+                digits = payload[1:] if payload[:1] == '-' else payload
+                if digits.isdecimal(): # Integer registers, the common case
+                    processed_value = int(payload)
+                else:
                     try: processed_value = float(payload)
-                    except ValueError:
-                        try: processed_value = int(payload)
-                        except ValueError: processed_value = payload # Keep as string if no conversion works
-            except Exception:
-                processed_value = payload # Fallback to raw string
-
-            update_message = RealTimeDataUpdate(
-                topic=topic,
-                device_name=device_name,
-                slave_id=slave_id,
-                register_type=register_type,
-                address=address,
-                value=processed_value
-            )
-            # Use model_dump_json for pydantic v2
-            message_str = update_message.model_dump_json()
-            # For older pydantic, it was update_message.json()
-            # logger.info(f"Formatted WS message: {message_str}")
-            # Important: manager.broadcast needs to be called from an async context if it awaits.
-            # Since this callback is synchronous, we need to schedule the broadcast.
-            # FastAPI doesn't have a simple asyncio.create_task from sync context directly for this.
-            # A common pattern is to use an asyncio.Queue or similar if strict async is needed here.
-            # For simplicity, if manager.broadcast is very quick and non-blocking internally (not awaiting heavily),
-            # this might appear to work, but it's not ideal. Best to make manager.broadcast truly async aware
-            # or use an intermediary queue.
-            # Let's assume for now direct call is for demonstration; FastAPI background tasks are better.
-            
-            # To properly call an async function from this synchronous callback:
-            # We need an event loop. FastAPI runs in an asyncio event loop.
-            # This direct call to an async method from a sync callback (paho-mqtt runs in its own thread)
-            # can be problematic. The proper way is to use `asyncio.run_coroutine_threadsafe` if you have access
-            # to the FastAPI event loop, or use BackgroundTasks in FastAPI for such operations.
-            # For now, let's make broadcast itself handle this, or simplify.
-            
-            # Simplification: if manager.broadcast is designed to be called from any thread and internally
-            # handles async operations correctly (e.g. by scheduling on an event loop), this is fine.
-            # Given our manager.broadcast iterates and calls await, this direct call will not work as expected
-            # from a sync thread. 
-            # The mqtt_service should run in a way that it can schedule async tasks on FastAPI's loop.
-            # This will be revised when integrating properly with FastAPI's event loop / background tasks.
-            # For a quick test, we can try to make manager.broadcast more robust or use a queue.
-
-            # *** TEMPORARY: Direct broadcast - this might block or fail in real async env ***
-            # This will be an issue because this callback is run in the MQTT client's thread.
-            # We need to hand this off to FastAPI's event loop.
-            # A more robust solution will involve asyncio.Queue or FastAPI's BackgroundTasks.
-            
-            # We'll mark this for revision when setting up background tasks for MQTT client properly.
-            # For now, we are demonstrating the data flow. The actual broadcast call will be refined.
-            logger.info(f"Scheduling broadcast for: {message_str}")
-            # Example: app.state.background_tasks.add_task(schedule_broadcast, message_str)
-            # This requires app.state.background_tasks to be set up and accessible.
+                    except ValueError: processed_value = payload # Keep as string if no conversion works
+
+            # Same shape as RealTimeDataUpdate, built as a plain dict: validating data we
+            # just constructed ourselves is wasted work on the per-message path.
+            update_message = {
+                "timestamp": datetime.utcnow().isoformat(),
+                "topic": topic,
+                "device_name": device_name,
+                "slave_id": slave_id,
+                "register_type": register_type,
+                "address": address,
+                "value": processed_value,
+            }
+            message_str = orjson.dumps(update_message).decode()
+            # _ws_broadcast_consumer sends it to the WebSocket clients
+            if WS_QUEUE is not None:
+                _enqueue_ws_message(message_str)
 
         else:
             logger.warning(f"Could not parse MQTT topic for WS: {topic}")
@@ -166,44 +169,63 @@ def handle_mqtt_for_websockets(topic: str, payload: str):
         logger.error(f"Error in handle_mqtt_for_websockets: {e}", exc_info=True)
 
 
+MQTT_STATUS_POLL_INTERVAL_S = 1.0
+
+async def _poll_mqtt_status(app: FastAPI):
+    # Health checks read this cached flag instead of calling client.is_connected() per
+    # request, which takes paho's state lock shared with its network thread.
+    while True:
+        app.state.mqtt_connected = bool(MQTT_SERVICE_INSTANCE and MQTT_SERVICE_INSTANCE.is_connected())
+        await asyncio.sleep(MQTT_STATUS_POLL_INTERVAL_S)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global MQTT_SERVICE_INSTANCE
+    global MQTT_SERVICE_INSTANCE, WS_QUEUE
     global API_CONFIG # Make sure API_CONFIG is available
     
     load_api_config_and_jwt_settings() # Load config and set JWT parameters
+
+    # Must exist before MQTT connects, since the MQTT callback enqueues onto it
+    WS_QUEUE = asyncio.Queue(maxsize=WS_QUEUE_MAXSIZE)
+    app.state.mqtt_connected = False
+    background_tasks = [asyncio.create_task(_ws_broadcast_consumer(WS_QUEUE))]
     
     mqtt_conf = API_CONFIG.get('mqtt_broker')
     if mqtt_conf:
-        MQTT_SERVICE_INSTANCE = MQTTService(
+        MQTT_SERVICE_INSTANCE = MQTTConsumerPool(
             broker_host=mqtt_conf.get('host'),
             broker_port=mqtt_conf.get('port'),
             client_id=mqtt_conf.get('api_client_id', 'modbus_api_subscriber'),
-            topic_prefix=mqtt_conf.get('data_topic_prefix', 'modbus/gateway')
+            topic_prefix=mqtt_conf.get('data_topic_prefix', 'modbus/gateway'),
+            workers=mqtt_conf.get('consumer_workers', 1),
+            shared_group=mqtt_conf.get('shared_group')
         )
         MQTT_SERVICE_INSTANCE.set_message_callback(handle_mqtt_for_websockets)
         MQTT_SERVICE_INSTANCE.connect()
         logger.info("MQTT Service started and connected within lifespan.")
     else:
         logger.warning("MQTT broker configuration not found in API_CONFIG. Real-time updates will be unavailable.")
-    
-    # Example: Store BackgroundTasks instance if needed by other parts (like MQTT handler)
-    # app.state.background_tasks = BackgroundTasks() 
+    background_tasks.append(asyncio.create_task(_poll_mqtt_status(app)))
     
     yield
     # Shutdown
     if MQTT_SERVICE_INSTANCE:
         MQTT_SERVICE_INSTANCE.disconnect()
         logger.info("MQTT Service disconnected during lifespan shutdown.")
-    # Closing InfluxDB client should be handled by its own service/dependency management
-    # if _influx_service_instance: _influx_service_instance.close()
+    WS_QUEUE = None
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    data_routes.close_influx_service()
 
 app = FastAPI(
     title="Modbus Integration Suite API",
     description="API for querying Modbus data, managing configurations, and real-time updates.",
     version="0.1.0",
-    lifespan=lifespan # Use the lifespan context manager
+    lifespan=lifespan, # Use the lifespan context manager
+    default_response_class=ORJSONResponse # orjson serializes responses several times faster than stdlib json
 )
 
 
@@ -216,7 +238,7 @@ async def read_root():
 @app.get("/api/v1/health")
 async def health_check():
     # Extended health check could ping InfluxDB and MQTT broker
-    mqtt_status = "connected" if MQTT_SERVICE_INSTANCE and MQTT_SERVICE_INSTANCE.client.is_connected() else "disconnected"
+    mqtt_status = "connected" if getattr(app.state, "mqtt_connected", False) else "disconnected" # Refreshed by _poll_mqtt_status
     # InfluxDB ping is done during get_influx_service, so if that works, API is generally fine with it.
     # For a dedicated health check, you might add a ping method to InfluxDBService.
     return {"status": "ok", "mqtt_broker_status": mqtt_status, "influxdb_status": "check_via_data_endpoint"}
@@ -254,4 +276,5 @@ async def read_users_me(current_user: Annotated[User, Depends(get_current_active
 # --- Main execution for local development (using uvicorn) ---
 if __name__ == "__main__":
     # Lifespan handles MQTT connection, so direct load_api_config not needed here if using lifespan for uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    # uvloop/httptools are libuv/C-backed replacements for the stdlib asyncio loop and h11 parser
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools", ws="websockets") 
\ No newline at end of file
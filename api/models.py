@@ -8,8 +8,8 @@
 #     price: float
 #     tax: float | None = None 
 
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 
 class HistoricalQuery(BaseModel):
@@ -17,11 +17,26 @@ class HistoricalQuery(BaseModel):
     end_time: datetime = Field(..., description="End of the time range (ISO format string)")
     measurement: Optional[str] = Field(default="modbus_data", description="The InfluxDB measurement name")
     device_name: Optional[str] = Field(default=None, description="Filter by device name")
-    slave_id: Optional[str] = Field(default=None, description="Filter by slave ID")
+    slave_id: Optional[List[str]] = Field(default=None, description="Filter by slave ID, or any of several")
     register_type: Optional[str] = Field(default=None, description="Filter by register type (e.g., holding_registers)")
-    address: Optional[str] = Field(default=None, description="Filter by specific register address")
+    address: Optional[List[str]] = Field(default=None, description="Filter by specific register address, or any of several")
     tags: Optional[Dict[str, str]] = Field(default=None, description="Additional tags to filter by")
-    # Add other parameters like aggregation_window if needed
+    limit: int = Field(default=1000, ge=1, le=10000, description="Maximum number of points per page")
+    cursor: Optional[str] = Field(default=None, description="Opaque cursor from a previous response's next_cursor to fetch the next page")
+    aggregate_every: Optional[str] = Field(default=None, pattern=r"^(\d+(ms|s|m|h|d|w))+$", description="Downsample into windows of this Flux duration (e.g. 1m, 1h30m)")
+    aggregate_fn: Optional[Literal["mean", "max", "min", "last"]] = Field(default=None, description="Aggregate applied per window; defaults to mean when aggregate_every is set")
+    sorted: bool = Field(default=True, description="Return points in time order. Unsorted pages come back in storage order (by series), which is cheaper for large ranges")
+    count_only: bool = Field(default=False, description="Return only the number of matching points (count), with no data")
+
+    @field_validator("slave_id", "address", mode="before")
+    @classmethod
+    def _coerce_tag_values(cls, value):
+        # Tags are stored as strings; accept a single value or numbers as well as a list
+        if value is None:
+            return None
+        if not isinstance(value, list):
+            value = [value]
+        return [str(v) for v in value]
 
 class DataPoint(BaseModel):
     time: datetime
@@ -33,8 +48,10 @@ class HistoricalDataResponse(BaseModel):
     query_params: HistoricalQuery
     count: int
     data: List[DataPoint]
+    next_cursor: Optional[str] = Field(default=None, description="Pass as 'cursor' to get the next page; null on the last page")
 
 class RealTimeDataUpdate(BaseModel):
+    # Schema of the WebSocket real-time messages; main.py serializes plain dicts of this shape
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     topic: str
     device_name: str
@@ -101,9 +118,32 @@ FAKE_USERS_DB = {
     }
 }
 
+# Validated model instances, built once at import. FAKE_USERS_DB is static apart from
+# password re-hashes, which go through update_user_password_hash below.
+_USERS: Dict[str, UserInDB] = {username: UserInDB(**user_dict) for username, user_dict in FAKE_USERS_DB.items()}
+
+def _to_public_user(user: UserInDB) -> User:
+    # model_construct skips validation; safe because the source is an already-validated UserInDB
+    return User.model_construct(
+        username=user.username,
+        email=user.email,
+        full_name=user.full_name,
+        disabled=user.disabled,
+    )
+
+# Same users without hashed_password, returned by authenticated-route dependencies
+_USERS_PUBLIC: Dict[str, User] = {username: _to_public_user(user) for username, user in _USERS.items()}
+
 # Helper to get user from our fake DB
 def get_user_from_db(username: str) -> Optional[UserInDB]:
-    if username in FAKE_USERS_DB:
-        user_dict = FAKE_USERS_DB[username]
-        return UserInDB(**user_dict)
-    return None 
\ No newline at end of file
+    return _USERS.get(username)
+
+def get_public_user(user: UserInDB) -> User:
+    public_user = _USERS_PUBLIC.get(user.username)
+    if public_user is None:
+        public_user = _to_public_user(user)
+    return public_user
+
+def update_user_password_hash(username: str, hashed_password: str) -> None:
+    FAKE_USERS_DB[username]["hashed_password"] = hashed_password
+    _USERS[username] = _USERS[username].model_copy(update={"hashed_password": hashed_password})
@@ -5,8 +5,9 @@ import paho.mqtt.client as mqtt
 from datetime import datetime
 
 from ..models import WriteRegisterRequest, WriteResponse
-from ..main import MQTT_SERVICE_INSTANCE # Import the shared MQTT service instance
-from ..main import API_CONFIG # To get MQTT topic for commands
+# The shared MQTT service instance and the API config (for the command topic) are read
+# from main at call time: both are set at startup, after this module is imported
+from .. import main as api_main
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -26,7 +27,8 @@ async def write_modbus_register(request: WriteRegisterRequest = Body(...)):
     This API endpoint currently sends the command and confirms it was sent to MQTT.
     It does not wait for a response from the Gateway.
     """
-    if not MQTT_SERVICE_INSTANCE or not MQTT_SERVICE_INSTANCE.client.is_connected():
+    mqtt_service = api_main.MQTT_SERVICE_INSTANCE
+    if not mqtt_service or not mqtt_service.client.is_connected():
         logger.error("MQTT service is not available or not connected. Cannot send write command.")
         raise HTTPException(status_code=503, detail="MQTT service unavailable. Cannot send command.")
 
@@ -60,12 +62,12 @@ async def write_modbus_register(request: WriteRegisterRequest = Body(...)):
 
         # Determine the MQTT topic
         # For this example, using a general command topic. The gateway will parse the payload for specifics.
-        mqtt_topic_config = API_CONFIG.get('mqtt_broker', {})
+        mqtt_topic_config = api_main.API_CONFIG.get('mqtt_broker', {})
         mqtt_topic = mqtt_topic_config.get('control_command_topic', CONTROL_COMMAND_GENERAL_TOPIC)
         
         # Publish the command to MQTT
         # The MQTTService's client is paho.mqtt.Client
-        result = MQTT_SERVICE_INSTANCE.client.publish(mqtt_topic, payload_str, qos=1) # QoS 1 for at least once
+        result = mqtt_service.client.publish(mqtt_topic, payload_str, qos=1) # QoS 1 for at least once
         
         if result.rc == mqtt.MQTT_ERR_SUCCESS:
             logger.info(f"Successfully published write command to MQTT topic '{mqtt_topic}': {payload_str}")
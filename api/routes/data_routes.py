@@ -1,38 +1,160 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import List, Optional, Annotated
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional, Annotated, Tuple
+from collections import OrderedDict
+from datetime import datetime, timezone
+import asyncio
+import hashlib
 import logging
+import time
+
+import orjson
 
 from ..models import HistoricalQuery, HistoricalDataResponse, DataPoint, User
-from ..services.influx_service import InfluxDBService
-from ..main import API_CONFIG
+from ..services.influx_service import InfluxDBService, FastDataPoint
+from .. import main as api_main
 from ..auth.dependencies import get_current_active_user
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+def _influx_config() -> dict:
+    # Read at call time: main loads API_CONFIG at startup, after this module is imported
+    return api_main.API_CONFIG.get('influxdb') or {}
+
 # --- Dependency to get InfluxDB service instance ---
 # This is a simple way; for larger apps, consider a more robust dependency injection system.
 _influx_service_instance: Optional[InfluxDBService] = None
+# Serializes the cold-start initialization so concurrent first requests create one client.
+# Created lazily: on Python 3.9 an asyncio.Lock binds to the loop current at construction.
+_influx_service_lock: Optional[asyncio.Lock] = None
+
+# async so FastAPI awaits it on the event loop; a sync dependency would be dispatched to
+# the threadpool on every request just to return the cached instance.
+async def get_influx_service():
+    global _influx_service_instance, _influx_service_lock
+    if _influx_service_instance is not None:
+        return _influx_service_instance
+    if _influx_service_lock is None:
+        _influx_service_lock = asyncio.Lock()
+    async with _influx_service_lock:
+        if _influx_service_instance is None:
+            influx_conf = _influx_config()
+            if not influx_conf:
+                logger.error("InfluxDB configuration not found in API_CONFIG.")
+                raise HTTPException(status_code=500, detail="InfluxDB not configured")
+
+            # Connecting pings InfluxDB (blocking HTTP), so keep it off the event loop
+            service = await run_in_threadpool(
+                InfluxDBService,
+                url=influx_conf.get('url'),
+                token=influx_conf.get('token'),
+                org=influx_conf.get('org'),
+                bucket=influx_conf.get('bucket'),
+                pool_size=influx_conf.get('pool_size', 64),
+                enable_gzip=influx_conf.get('enable_gzip', True),
+                timeout_ms=influx_conf.get('timeout_ms', 30_000),
+                client_pool_size=influx_conf.get('client_pool_size', 8)
+            )
+            if not service.client: # Check if connection failed during init
+                raise HTTPException(status_code=503, detail="Could not connect to InfluxDB. Service unavailable.")
+            _influx_service_instance = service
+    return _influx_service_instance
 
-def get_influx_service():
+def close_influx_service():
+    """Close the shared InfluxDB client. Called once on application shutdown, never per request."""
     global _influx_service_instance
-    if _influx_service_instance is None:
-        influx_conf = API_CONFIG.get('influxdb')
-        if not influx_conf:
-            logger.error("InfluxDB configuration not found in API_CONFIG.")
-            raise HTTPException(status_code=500, detail="InfluxDB not configured")
-        
-        _influx_service_instance = InfluxDBService(
-            url=influx_conf.get('url'),
-            token=influx_conf.get('token'),
-            org=influx_conf.get('org'),
-            bucket=influx_conf.get('bucket')
+    if _influx_service_instance is not None:
+        _influx_service_instance.close()
+        _influx_service_instance = None
+
+# --- Short-lived cache of historical query responses ---
+# Dashboards poll the same query repeatedly; identical bodies within the TTL are served
+# from here instead of re-running the Flux query. Results aren't user-scoped, so the key
+# is the query alone. Only touched from the event loop, so no locking is needed.
+HISTORICAL_CACHE_MAXSIZE = 256
+HISTORICAL_CACHE_TTL_S = 15.0
+# Ranges that end in the future still receive new points; keep them only briefly
+HISTORICAL_CACHE_LIVE_TTL_S = 1.0
+# Values are the serialized response bodies, so hits skip serialization as well
+_historical_cache: "OrderedDict[bytes, Tuple[float, bytes]]" = OrderedDict()
+
+def _historical_cache_key(query_params: HistoricalQuery) -> bytes:
+    canonical = orjson.dumps(query_params.model_dump(mode="json"), option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+def _historical_cache_get(key: bytes) -> Optional[bytes]:
+    entry = _historical_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, response = entry
+    if time.monotonic() >= expires_at:
+        del _historical_cache[key]
+        return None
+    _historical_cache.move_to_end(key)
+    return response
+
+def _historical_cache_put(key: bytes, query_params: HistoricalQuery, response: bytes):
+    end_time = query_params.end_time
+    if end_time.tzinfo is None: # Naive times are UTC, as in the InfluxDB query
+        end_time = end_time.replace(tzinfo=timezone.utc)
+    live = end_time > datetime.now(timezone.utc)
+    ttl = HISTORICAL_CACHE_LIVE_TTL_S if live else HISTORICAL_CACHE_TTL_S
+    _historical_cache[key] = (time.monotonic() + ttl, response)
+    _historical_cache.move_to_end(key)
+    if len(_historical_cache) > HISTORICAL_CACHE_MAXSIZE:
+        _historical_cache.popitem(last=False)
+
+# Upper bound on one historical query, so a pathological range can't hold a worker
+# indefinitely. Overridable as influxdb.query_timeout_s.
+DEFAULT_QUERY_TIMEOUT_S = 30.0
+
+def _serialize_historical(query_params: HistoricalQuery, data: List[FastDataPoint],
+                          count: int, next_cursor: Optional[str] = None) -> bytes:
+    # Encodes a HistoricalDataResponse body. The points are plain dataclasses that orjson
+    # serializes natively, so no DataPoint model is built per point.
+    return orjson.dumps({
+        "query_params": query_params.model_dump(mode="json"),
+        "count": count,
+        "data": data,
+        "next_cursor": next_cursor,
+    }, option=orjson.OPT_UTC_Z)
+
+async def _query_historical(influx_service: InfluxDBService, query_params: HistoricalQuery) -> bytes:
+    if query_params.count_only:
+        count = await run_in_threadpool(
+            influx_service.count_historical_data,
+            start_time=query_params.start_time,
+            end_time=query_params.end_time,
+            measurement=query_params.measurement,
+            device_name=query_params.device_name,
+            slave_id=query_params.slave_id,
+            register_type=query_params.register_type,
+            address=query_params.address,
+            tags=query_params.tags,
+            aggregate_every=query_params.aggregate_every,
+            aggregate_fn=query_params.aggregate_fn
         )
-        if not _influx_service_instance.client: # Check if connection failed during init
-             _influx_service_instance = None # Reset if failed
-             raise HTTPException(status_code=503, detail="Could not connect to InfluxDB. Service unavailable.")
-    return _influx_service_instance
+        return _serialize_historical(query_params, [], count)
+    # The InfluxDB client does blocking HTTP; run it in the threadpool so concurrent
+    # queries don't serialize on the event loop.
+    data_points, next_cursor = await run_in_threadpool(
+        influx_service.query_historical_data,
+        start_time=query_params.start_time,
+        end_time=query_params.end_time,
+        measurement=query_params.measurement,
+        device_name=query_params.device_name,
+        slave_id=query_params.slave_id,
+        register_type=query_params.register_type,
+        address=query_params.address,
+        tags=query_params.tags,
+        limit=query_params.limit,
+        cursor=query_params.cursor,
+        aggregate_every=query_params.aggregate_every,
+        aggregate_fn=query_params.aggregate_fn,
+        sort=query_params.sorted
+    )
+    return _serialize_historical(query_params, data_points, len(data_points), next_cursor)
 
 @router.post("/historical", response_model=HistoricalDataResponse)
 async def get_historical_data(
@@ -46,23 +168,24 @@ async def get_historical_data(
     """
     try:
         logger.info(f"User {current_user.username} querying historical data: {query_params.model_dump_json(indent=2)}")
-        data_points: List[DataPoint] = influx_service.query_historical_data(
-            start_time=query_params.start_time,
-            end_time=query_params.end_time,
-            measurement=query_params.measurement,
-            device_name=query_params.device_name,
-            slave_id=query_params.slave_id,
-            register_type=query_params.register_type,
-            address=query_params.address,
-            tags=query_params.tags
-        )
-        return HistoricalDataResponse(
-            query_params=query_params,
-            count=len(data_points),
-            data=data_points
-        )
+        cache_key = _historical_cache_key(query_params)
+        body = _historical_cache_get(cache_key)
+        if body is None:
+            timeout_s = _influx_config().get('query_timeout_s', DEFAULT_QUERY_TIMEOUT_S)
+            try:
+                body = await asyncio.wait_for(_query_historical(influx_service, query_params), timeout=timeout_s)
+            except asyncio.TimeoutError:
+                # The worker thread finishes on its own; the client's HTTP timeout bounds it
+                logger.warning(f"Historical query for user {current_user.username} timed out after {timeout_s}s")
+                raise HTTPException(status_code=504, detail="Historical query timed out")
+            _historical_cache_put(cache_key, query_params, body)
+        # Already-encoded HistoricalDataResponse; returning the model instead would have
+        # FastAPI re-validate it against response_model and dump it to dicts first.
+        return Response(content=body, media_type="application/json")
     except HTTPException: # Re-raise HTTPExceptions from dependency
         raise
+    except ValueError as e: # Rejected query parameters, e.g. an invalid tag key
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error processing historical data query for user {current_user.username}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
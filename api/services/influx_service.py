@@ -1,33 +1,185 @@
+import itertools
 import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
 from influxdb_client import InfluxDBClient
-from influxdb_client.client.flux_table import FluxStructureEncoder
-from typing import List, Dict, Optional
-from datetime import datetime
+from typing import Any, List, Dict, Optional, Tuple, Union
+from datetime import datetime, timedelta, timezone
 
-from ..models import DataPoint # Assuming models.py is one level up
 
 logger = logging.getLogger(__name__)
 
+# Valid identifier for a tag key used in a Flux column reference
+_TAG_KEY_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# Record columns that aren't tags. 'result' and 'table' are added by the client's CSV
+# parser (they are not data columns), so they can't be dropped in the query.
+_NON_TAG_COLUMNS = frozenset({'_time', '_value', '_field', '_measurement', 'result', 'table'})
+
+def _as_utc(value: datetime) -> datetime:
+    # Naive datetimes are treated as UTC, as the InfluxDB client does for query parameters
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+_DURATION_UNITS = {"ms": timedelta(milliseconds=1), "s": timedelta(seconds=1), "m": timedelta(minutes=1),
+                   "h": timedelta(hours=1), "d": timedelta(days=1), "w": timedelta(weeks=1)}
+_DURATION_RE = re.compile(r"(\d+)(ms|s|m|h|d|w)")
+
+def _parse_duration(value: str) -> timedelta:
+    # Flux duration literal (e.g. "1h30m") as a timedelta, so it can be sent as a query parameter
+    parts = _DURATION_RE.findall(value)
+    if not parts or "".join(n + unit for n, unit in parts) != value:
+        raise ValueError(f"Invalid duration: {value!r}")
+    duration = sum((int(n) * _DURATION_UNITS[unit] for n, unit in parts), timedelta())
+    if not duration:
+        raise ValueError(f"Invalid duration: {value!r}")
+    return duration
+
+def _encode_cursor(time: datetime, offset: int) -> str:
+    return f"{time.isoformat()}|{offset}"
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    # Cursor is "<ISO timestamp>|<points at that timestamp already returned>"
+    time_str, sep, offset_str = cursor.rpartition("|")
+    try:
+        if not sep:
+            raise ValueError
+        return _as_utc(datetime.fromisoformat(time_str)), int(offset_str)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+@dataclass
+class FastDataPoint:
+    """Same shape as DataPoint without the pydantic model overhead, for large result sets.
+
+    orjson serializes it natively, so the route can encode the response without
+    converting each point to a model first.
+    """
+    __slots__ = ("time", "measurement", "tags", "fields")
+    time: datetime
+    measurement: str
+    tags: Dict[str, str]
+    fields: Dict[str, Any]
+
+_FILTER_COLUMNS = ("device_name", "slave_id", "register_type", "address")
+
+_AGGREGATE_FNS = frozenset({"mean", "max", "min", "last"})
+
+@lru_cache(maxsize=256)
+def _build_flux_query(filter_columns: Tuple[Tuple[str, bool], ...], tag_keys: Tuple[str, ...],
+                      aggregate_fn: Optional[str] = None, sort: bool = True, count_only: bool = False) -> str:
+    """Flux query text for a given set of filters; cached since it only depends on which filters are present."""
+    # User values are passed as query parameters (the client sends them as Flux options,
+    # referenced below as _name) rather than interpolated, so they can't inject Flux.
+    lines = [
+        'from(bucket: _bucket)',
+        ' |> range(start: _start, stop: _stop)',
+        ' |> filter(fn: (r) => r._measurement == _measurement_name)',
+    ]
+    for column, multi in filter_columns:
+        if multi: # Match any of several values, passed as one array parameter
+            lines.append(f' |> filter(fn: (r) => contains(value: r.{column}, set: _{column}))')
+        else:
+            lines.append(f' |> filter(fn: (r) => r.{column} == _{column})')
+    for i, tag_key in enumerate(tag_keys):
+        # Tag keys are column names and can't be passed as parameters
+        if not _TAG_KEY_RE.match(tag_key):
+            raise ValueError(f"Invalid tag key: {tag_key!r}")
+        lines.append(f' |> filter(fn: (r) => r["{tag_key}"] == _tag_{i})')
+    if aggregate_fn:
+        # Downsample per series in InfluxDB. The function is an identifier, not a value, so it
+        # is interpolated from a fixed set; the window size is a parameter.
+        if aggregate_fn not in _AGGREGATE_FNS:
+            raise ValueError(f"Invalid aggregate function: {aggregate_fn!r}")
+        lines.append(f' |> aggregateWindow(every: _aggregate_every, fn: {aggregate_fn}, createEmpty: false)')
+    if count_only:
+        # Count across all series in InfluxDB; only the single number comes back
+        lines.append(' |> group()')
+        lines.append(' |> count(column: "_value")')
+        lines.append(' |> keep(columns: ["_value"])')
+        return "\n".join(lines)
+    # _start/_stop repeat the query range on every row; drop them server-side so they
+    # aren't sent over the wire and parsed per record.
+    lines.append(' |> drop(columns: ["_start", "_stop"])')
+    # Merge all series into one table so sort and limit apply across series, not per
+    # series. Sorting by time plus the series tags gives a stable order for paging.
+    lines.append(' |> group()')
+    if sort:
+        lines.append(' |> sort(columns: ["_time", "device_name", "slave_id", "register_type", "address", "_field"], desc: false)')
+    # One extra point tells us whether there is a next page
+    lines.append(' |> limit(n: _limit, offset: _offset)')
+    return "\n".join(lines)
+
+FilterValue = Union[str, List[str]]
+
+def _add_filter_params(params: Dict[str, Any], device_name: Optional[str], slave_id: Optional[FilterValue],
+                       register_type: Optional[str], address: Optional[FilterValue], tags: Optional[Dict[str, str]],
+                       aggregate_every: Optional[str], aggregate_fn: Optional[str]):
+    # Adds the optional filters to params and returns the _build_flux_query signature for them
+    filter_columns = []
+    for column, value in zip(_FILTER_COLUMNS, (device_name, slave_id, register_type, address)):
+        if not value:
+            continue
+        if not isinstance(value, str) and len(value) == 1:
+            value = value[0] # Plain equality for a single value
+        multi = not isinstance(value, str)
+        filter_columns.append((column, multi))
+        params[f"_{column}"] = list(value) if multi else value
+    tag_keys = tuple(tags) if tags else ()
+    for i, tag_key in enumerate(tag_keys):
+        params[f"_tag_{i}"] = tags[tag_key]
+    if aggregate_every:
+        params["_aggregate_every"] = _parse_duration(aggregate_every)
+        aggregate_fn = aggregate_fn or "mean"
+    else:
+        aggregate_fn = None
+    return tuple(filter_columns), tag_keys, aggregate_fn
+
 class InfluxDBService:
-    def __init__(self, url: str, token: str, org: str, bucket: str):
+    def __init__(self, url: str, token: str, org: str, bucket: str,
+                 pool_size: int = 64, enable_gzip: bool = True, timeout_ms: int = 30_000,
+                 client_pool_size: int = 8):
         self.url = url
         self.token = token
         self.org = org
         self.bucket = bucket
+        self.pool_size = pool_size
+        self.enable_gzip = enable_gzip
+        self.timeout_ms = timeout_ms
+        self.client_pool_size = max(1, client_pool_size)
         self.client: Optional[InfluxDBClient] = None
+        # Queries are spread round-robin over several clients, each with its own urllib3
+        # pool, so concurrent queries don't contend inside a single client.
+        self.clients: List[InfluxDBClient] = []
+        self._client_cycle = None
         self._connect()
 
+    def _new_client(self) -> InfluxDBClient:
+        # Clients live for the process lifetime; the pool size (split across the clients) is
+        # sized for concurrent queries so connections are reused instead of re-opened.
+        return InfluxDBClient(
+            url=self.url, token=self.token, org=self.org,
+            connection_pool_maxsize=max(1, self.pool_size // self.client_pool_size),
+            enable_gzip=self.enable_gzip,
+            timeout=self.timeout_ms
+        )
+
     def _connect(self):
         try:
-            self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
+            self.client = self._new_client()
             if self.client.ping():
                 logger.info(f"Successfully connected to InfluxDB at {self.url} for org '{self.org}'")
             else:
                 logger.error(f"Failed to ping InfluxDB at {self.url}. Check connection or credentials.")
+                self.client.close()
                 self.client = None
+                return
         except Exception as e:
             logger.error(f"Exception connecting to InfluxDB: {e}")
             self.client = None
+            return
+        self.clients = [self.client] + [self._new_client() for _ in range(self.client_pool_size - 1)]
+        # next() on an itertools.cycle is a single C call, so it's safe across threadpool threads
+        self._client_cycle = itertools.cycle(self.clients)
 
     def query_historical_data(
         self,
@@ -35,72 +187,116 @@ class InfluxDBService:
         end_time: datetime,
         measurement: str = "modbus_data",
         device_name: Optional[str] = None,
-        slave_id: Optional[str] = None,
+        slave_id: Optional[FilterValue] = None,
+        register_type: Optional[str] = None,
+        address: Optional[FilterValue] = None,
+        tags: Optional[Dict[str, str]] = None,
+        limit: int = 1000,
+        cursor: Optional[str] = None,
+        aggregate_every: Optional[str] = None,
+        aggregate_fn: Optional[str] = None,
+        sort: bool = True
+    ) -> Tuple[List[FastDataPoint], Optional[str]]:
+        """Return one page of points (at most `limit`) and the cursor for the next page, if any.
+
+        Raises if InfluxDB can't be queried, rather than returning an empty page that
+        would pass for (and be cached as) a range with no data.
+        """
+        if not self.client:
+            logger.error("InfluxDB client not initialized. Cannot query data.")
+            raise RuntimeError("InfluxDB client not initialized")
+
+        cursor_time, cursor_offset = _decode_cursor(cursor) if cursor else (None, 0)
+        if cursor_time is not None:
+            start_time = max(_as_utc(start_time), cursor_time)
+
+        query_api = next(self._client_cycle).query_api()
+
+        params = {"_bucket": self.bucket, "_start": start_time, "_stop": end_time, "_measurement_name": measurement,
+                  "_limit": limit + 1, "_offset": cursor_offset}
+        filter_columns, tag_keys, aggregate_fn = _add_filter_params(
+            params, device_name, slave_id, register_type, address, tags, aggregate_every, aggregate_fn)
+        flux_query = _build_flux_query(filter_columns, tag_keys, aggregate_fn, sort)
+
+        logger.info(f"Executing Flux query: \n{flux_query}\nwith params: {params}")
+
+        try:
+            # query_stream parses and yields records one at a time, so the FluxTables are
+            # never held in memory alongside the point list.
+            records = query_api.query_stream(query=flux_query, org=self.org, params=params)
+            results: List[FastDataPoint] = []
+            append = results.append
+            for record in records:
+                # Read the columns straight from record.values instead of through the FluxRecord
+                # getters. No validation: the rows come from our own query with typed columns,
+                # so they already match the DataPoint schema.
+                values = record.values
+                append(FastDataPoint(
+                    values['_time'],
+                    values['_measurement'],
+                    {k: values[k] for k in values.keys() - _NON_TAG_COLUMNS},
+                    {values['_field']: values['_value']}
+                ))
+        except Exception as e:
+            logger.error(f"Error querying InfluxDB: {e}")
+            raise
+
+        if len(results) <= limit:
+            return results, None
+        results = results[:limit]
+        if not sort or aggregate_fn:
+            # Page by offset alone from the original start: storage order isn't time order, and
+            # aggregated rows are stamped with their window's stop, so a range restarting at
+            # that time would compute different windows
+            return results, _encode_cursor(_as_utc(start_time), cursor_offset + limit)
+        next_time = results[-1].time
+        # The next page starts at the last returned timestamp (range start is inclusive);
+        # skip the points at that timestamp that were already returned.
+        skip = sum(1 for point in results if point.time == next_time)
+        if next_time == cursor_time:
+            skip += cursor_offset
+        return results, _encode_cursor(next_time, skip)
+
+    def count_historical_data(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        measurement: str = "modbus_data",
+        device_name: Optional[str] = None,
+        slave_id: Optional[FilterValue] = None,
         register_type: Optional[str] = None,
-        address: Optional[str] = None,
-        tags: Optional[Dict[str, str]] = None
-    ) -> List[DataPoint]:
+        address: Optional[FilterValue] = None,
+        tags: Optional[Dict[str, str]] = None,
+        aggregate_every: Optional[str] = None,
+        aggregate_fn: Optional[str] = None
+    ) -> int:
+        """Return the number of points matching the filters, counted in InfluxDB. Raises if it can't be queried."""
         if not self.client:
             logger.error("InfluxDB client not initialized. Cannot query data.")
-            return []
-
-        query_api = self.client.query_api()
-
-        # Construct Flux query dynamically
-        flux_query = f'''from(bucket: "{self.bucket}")
-          |> range(start: {start_time.isoformat()}Z, stop: {end_time.isoformat()}Z)
-          |> filter(fn: (r) => r._measurement == "{measurement}")
-        '''
-        if device_name:
-            flux_query += f' |> filter(fn: (r) => r.device_name == "{device_name}")\n'
-        if slave_id:
-            flux_query += f' |> filter(fn: (r) => r.slave_id == "{slave_id}")\n'
-        if register_type:
-            flux_query += f' |> filter(fn: (r) => r.register_type == "{register_type}")\n'
-        if address:
-            flux_query += f' |> filter(fn: (r) => r.address == "{address}")\n'
-        
-        if tags:
-            for tag_key, tag_value in tags.items():
-                flux_query += f' |> filter(fn: (r) => r["{tag_key}"] == "{tag_value}")\n'
-        
-        # Add a sort by time, essential for chronological data
-        flux_query += ' |> sort(columns: ["_time"], desc: false)\n'
-        # flux_query += ' |> yield(name: "results")' # Optional: name the result stream
-
-        logger.info(f"Executing Flux query: \n{flux_query}")
+            raise RuntimeError("InfluxDB client not initialized")
+
+        params = {"_bucket": self.bucket, "_start": start_time, "_stop": end_time, "_measurement_name": measurement}
+        filter_columns, tag_keys, aggregate_fn = _add_filter_params(
+            params, device_name, slave_id, register_type, address, tags, aggregate_every, aggregate_fn)
+        flux_query = _build_flux_query(filter_columns, tag_keys, aggregate_fn, count_only=True)
+
+        logger.info(f"Executing Flux query: \n{flux_query}\nwith params: {params}")
 
         try:
-            tables = query_api.query(query=flux_query, org=self.org)
-            results: List[DataPoint] = []
-            for table in tables:
-                for record in table.records:
-                    # Convert FluxRecord to our DataPoint model
-                    # Ensure all fields required by DataPoint are present or handled
-                    tags_dict = {k: v for k, v in record.values.items() if k not in ['_time', '_start', '_stop', '_value', '_field', '_measurement', 'result', 'table']}
-                    
-                    # Filter out internal fields if they are not proper tags
-                    internal_flux_fields = ['result', 'table']
-                    for internal_field in internal_flux_fields:
-                        tags_dict.pop(internal_field, None)
-
-                    results.append(
-                        DataPoint(
-                            time=record.get_time(),
-                            measurement=record.get_measurement(),
-                            tags=tags_dict,
-                            fields={record.get_field(): record.get_value()}
-                        )
-                    )
-            return results
+            records = next(self._client_cycle).query_api().query_stream(query=flux_query, org=self.org, params=params)
+            # No matching series means no table at all, rather than a zero count
+            return sum(record.values['_value'] for record in records)
         except Exception as e:
             logger.error(f"Error querying InfluxDB: {e}")
-            return []
+            raise
 
     def close(self):
-        if self.client:
-            self.client.close()
-            logger.info("InfluxDB client connection closed.")
+        if self.clients:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+            self.client = None
+            logger.info("InfluxDB client connections closed.")
 
 # Example of how to instantiate (will be done in main.py or a dependency injector)
 # influx_service = InfluxDBService(url="..."), token="...", org="...", bucket="...") 
\ No newline at end of file
@@ -1,68 +1,186 @@
+import asyncio
 import logging
+import os
+import socket
 import paho.mqtt.client as mqtt
-import json
-from typing import Callable, Optional, Any
+from typing import Callable, Optional, Any, List
 
 logger = logging.getLogger(__name__)
 
+# Messages waiting for the consumer task; beyond this they are dropped rather than
+# letting a stalled consumer grow memory without bound.
+MESSAGE_QUEUE_MAXSIZE = 20_000
+# Messages handled per consumer wake-up
+MESSAGE_BATCH_SIZE = 1000
+# paho doubles the reconnect delay after each failed attempt, between these bounds (seconds)
+RECONNECT_MIN_DELAY_S = 1
+RECONNECT_MAX_DELAY_S = 120
+
 class MQTTService:
-    def __init__(self, broker_host: str, broker_port: int, client_id: str, topic_prefix: str):
+    def __init__(self, broker_host: str, broker_port: int, client_id: str, topic_prefix: str,
+                 shared_group: Optional[str] = None):
         self.broker_host = broker_host
         self.broker_port = broker_port
         self.client_id = client_id
         self.topic_prefix = topic_prefix # e.g., "modbus/gateway"
-        self.client = mqtt.Client(client_id=self.client_id)
+        # With a shared group, the broker load-balances the data topics across all clients
+        # subscribed in that group (MQTT v5 shared subscriptions) instead of copying to each.
+        self.shared_group = shared_group
+        protocol = mqtt.MQTTv5 if shared_group else mqtt.MQTTv311
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id=self.client_id, protocol=protocol)
         self.message_callback: Optional[Callable[[str, Any], None]] = None # topic, payload
 
+        # paho's network thread only hands (topic, payload bytes) over to the event loop;
+        # decoding and the message callback run in _consume on the loop (set up in connect).
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional["asyncio.Queue[tuple]"] = None
+        self._consumer_task: Optional[asyncio.Task] = None
+
+        # Back off between reconnects so a restarted broker isn't hit by every client at once
+        self.client.reconnect_delay_set(min_delay=RECONNECT_MIN_DELAY_S, max_delay=RECONNECT_MAX_DELAY_S)
+        self.client.enable_logger(logger)
+        self.reconnect_attempts = 0
+
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
 
-    def _on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if not reason_code.is_failure:
+            self.reconnect_attempts = 0
             logger.info(f"Successfully connected to MQTT broker at {self.broker_host}:{self.broker_port} as {self.client_id}")
             # Subscribe to all sub-topics under the gateway's data prefix
             # Example: modbus/gateway/Device1/1/holding_registers/0
             subscription_topic = f"{self.topic_prefix}/#"
+            if self.shared_group:
+                subscription_topic = f"$share/{self.shared_group}/{subscription_topic}"
             self.client.subscribe(subscription_topic, qos=1)
             logger.info(f"Subscribed to MQTT topic: {subscription_topic}")
         else:
-            logger.error(f"Failed to connect to MQTT broker, return code {rc}")
+            logger.error(f"Failed to connect to MQTT broker, reason: {reason_code}")
 
     def _on_message(self, client, userdata, msg):
-        logger.debug(f"Received MQTT message on topic {msg.topic}: {msg.payload.decode()}")
+        # Runs on paho's network thread: keep it to the handoff so the loop keeps reading
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._enqueue, msg.topic, msg.payload)
+
+    def _enqueue(self, topic: str, payload: bytes):
+        # Runs on the event loop via call_soon_threadsafe
         try:
-            # Assuming payload is a simple string value, as sent by the gateway
-            # If it's JSON, use json.loads(msg.payload.decode())
-            payload_data = msg.payload.decode()
-            if self.message_callback:
-                # We can pass the raw topic and payload, or parse it further here
-                # For now, passing topic and raw payload string
-                self.message_callback(msg.topic, payload_data)
-        except Exception as e:
-            logger.error(f"Error processing MQTT message on topic {msg.topic}: {e}", exc_info=True)
+            self._queue.put_nowait((topic, payload))
+        except asyncio.QueueFull:
+            logger.warning(f"MQTT message queue is full; dropping message on topic {topic}")
+
+    async def _consume(self):
+        queue = self._queue
+        while True:
+            # Drain whatever has queued up (bounded) per wake-up, so a burst from the gateway
+            # is handled in one pass instead of one scheduler round trip per message.
+            batch = [await queue.get()]
+            while len(batch) < MESSAGE_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+            callback = self.message_callback
+            for topic, payload in batch:
+                try:
+                    # Assuming payload is a simple string value, as sent by the gateway
+                    # If it's JSON, use json.loads(payload.decode())
+                    payload_data = payload.decode()
+                    logger.debug("Received MQTT message on topic %s: %s", topic, payload_data)
+                    if callback:
+                        # We can pass the raw topic and payload, or parse it further here
+                        # For now, passing topic and raw payload string
+                        callback(topic, payload_data)
+                except Exception as e:
+                    logger.error(f"Error processing MQTT message on topic {topic}: {e}", exc_info=True)
 
-    def _on_disconnect(self, client, userdata, rc):
-        logger.warning(f"Disconnected from MQTT broker with result code {rc}. Attempting to reconnect...")
-        # Implement reconnection logic if needed, or rely on a wrapper/keepalive mechanism
-        # For simplicity, paho-mqtt's loop_start handles some reconnection attempts by default
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        if reason_code.is_failure: # Unexpected; not our own disconnect()
+            self.reconnect_attempts += 1
+            # loop_start's thread reconnects on its own, with the backoff set in __init__
+            logger.warning(f"Disconnected from MQTT broker, reason: {reason_code}. "
+                           f"Reconnecting (attempt {self.reconnect_attempts})...")
+        else:
+            logger.info("Disconnected from MQTT broker.")
 
     def set_message_callback(self, callback: Callable[[str, Any], None]):
-        """Set the callback function to be invoked when a message is received."""
+        """Set the callback function to be invoked when a message is received.
+
+        The callback runs on the asyncio event loop that called connect().
+        """
         self.message_callback = callback
 
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
     def connect(self):
+        """Connect and start the network loop. Must be called from a running asyncio event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=MESSAGE_QUEUE_MAXSIZE)
+        self._consumer_task = self._loop.create_task(self._consume())
         try:
-            self.client.connect(self.broker_host, self.broker_port, 60)
+            # connect_async leaves the first connect to the network thread, so a broker that
+            # isn't up yet is retried with the same backoff instead of failing startup.
+            self.client.connect_async(self.broker_host, self.broker_port, 60)
             self.client.loop_start() # Start network loop in a background thread
         except Exception as e:
             logger.error(f"MQTT connection failed: {e}", exc_info=True)
 
     def disconnect(self):
-        if self.client.is_connected():
-            self.client.loop_stop() # Stop the network loop
-            self.client.disconnect()
-            logger.info("Disconnected from MQTT broker.")
+        # Stop the network loop even if never connected: it may still be retrying
+        self.client.disconnect()
+        self.client.loop_stop()
+        self._loop = None
+        if self._consumer_task is not None:
+            self._consumer_task.cancel()
+            self._consumer_task = None
+
+def _process_shared_group() -> str:
+    # Unique to this process, so its workers split the stream only among themselves
+    return f"api-{socket.gethostname()}-{os.getpid()}"
+
+class MQTTConsumerPool:
+    """One or more MQTTService workers; several share one subscription group.
+
+    Each worker has its own paho client and network thread, so reading the data topics
+    can spread across workers. Exposes the same interface as MQTTService; .client is the
+    first worker's client, used for publishing.
+
+    The broker splits a shared group's messages across every client in it, so each API
+    process must see the whole stream in its own group: by default one unique to the
+    process. Naming a shared_group is only safe when a single fan-out process consumes
+    it; replicas joining it would each get only part of the updates.
+    """
+    def __init__(self, broker_host: str, broker_port: int, client_id: str, topic_prefix: str,
+                 workers: int = 1, shared_group: Optional[str] = None):
+        if workers > 1:
+            shared_group = shared_group or _process_shared_group()
+            self.workers: List[MQTTService] = [
+                MQTTService(broker_host, broker_port, f"{client_id}-{i}", topic_prefix, shared_group=shared_group)
+                for i in range(workers)
+            ]
+        else: # A single worker needs no shared subscription
+            self.workers = [MQTTService(broker_host, broker_port, client_id, topic_prefix)]
+
+    @property
+    def client(self) -> mqtt.Client:
+        return self.workers[0].client
+
+    def is_connected(self) -> bool:
+        return any(worker.is_connected() for worker in self.workers)
+
+    def set_message_callback(self, callback: Callable[[str, Any], None]):
+        for worker in self.workers:
+            worker.set_message_callback(callback)
+
+    def connect(self):
+        for worker in self.workers:
+            worker.connect()
+
+    def disconnect(self):
+        for worker in self.workers:
+            worker.disconnect()
 
 # Example usage (will be integrated into FastAPI app lifecycle):
 # def my_callback(topic, payload):
@@ -0,0 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from api.auth import auth_routes, security
+from api.models import FAKE_USERS_DB
+
+
+def _verified_cost(monkeypatch, username, password):
+    # Cost of the hash the login verifies against, for a login expected to fail
+    costs = []
+
+    def verify(plain_password, hashed_password):
+        costs.append(security._hash_cost(hashed_password))
+        return security.verify_and_update_password(plain_password, hashed_password)
+
+    monkeypatch.setattr(auth_routes, "verify_and_update_password", verify)
+    form = SimpleNamespace(username=username, password=password)
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(auth_routes.login_for_access_token(form))
+    assert exc_info.value.status_code == 401
+    return costs[0]
+
+
+@pytest.mark.parametrize("bcrypt_rounds", [4, 10])
+def test_unknown_user_and_wrong_password_verify_at_the_same_cost(monkeypatch, bcrypt_rounds):
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", security.BCRYPT_ROUNDS)
+    monkeypatch.setattr(security, "DUMMY_PASSWORD_HASH", security.DUMMY_PASSWORD_HASH)
+    # Stored hashes cost more than the configured rounds until their users log in
+    security.configure_password_hashing({"bcrypt_rounds": bcrypt_rounds})
+
+    unknown_cost = _verified_cost(monkeypatch, "no-such-user", "wrong")
+    wrong_password_cost = _verified_cost(monkeypatch, "admin", "wrong")
+    assert unknown_cost == wrong_password_cost == security._hash_cost(FAKE_USERS_DB["admin"]["hashed_password"])
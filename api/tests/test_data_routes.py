@@ -0,0 +1,94 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+
+import pytest
+from fastapi import HTTPException
+
+from api import main
+from api.models import HistoricalQuery, User
+from api.routes import data_routes
+from api.services.influx_service import InfluxDBService
+
+
+class FakeInfluxService:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.client = object()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_influx(monkeypatch):
+    monkeypatch.setattr(data_routes, "InfluxDBService", FakeInfluxService)
+    monkeypatch.setattr(data_routes, "_influx_service_instance", None)
+    monkeypatch.setattr(data_routes, "_influx_service_lock", None)
+
+
+def test_influx_settings_loaded_after_import_take_effect(fake_influx, monkeypatch, tmp_path):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(
+        "influxdb:\n"
+        "  url: http://influxdb:8086\n"
+        "  token: t\n"
+        "  org: o\n"
+        "  bucket: b\n"
+        "  pool_size: 3\n"
+        "  client_pool_size: 2\n"
+        "  enable_gzip: false\n"
+        "  query_timeout_s: 5\n"
+    )
+    monkeypatch.setattr(main, "API_CONFIG", {})
+    # As at startup: the routes modules are already imported when main loads the config
+    main.load_api_config_and_jwt_settings(str(config_file))
+
+    service = asyncio.run(data_routes.get_influx_service())
+    assert service.kwargs["pool_size"] == 3
+    assert service.kwargs["client_pool_size"] == 2
+    assert service.kwargs["enable_gzip"] is False
+    assert data_routes._influx_config()["query_timeout_s"] == 5
+
+
+def test_influx_defaults_without_settings(fake_influx, monkeypatch):
+    monkeypatch.setattr(main, "API_CONFIG", {"influxdb": {"url": "http://influxdb:8086"}})
+
+    service = asyncio.run(data_routes.get_influx_service())
+    assert service.kwargs["pool_size"] == 64
+    assert service.kwargs["client_pool_size"] == 8
+    assert service.kwargs["enable_gzip"] is True
+
+
+class FailingQueryApi:
+    def query_stream(self, **kwargs):
+        raise ConnectionError("InfluxDB unreachable")
+
+
+class FailingClient:
+    def query_api(self):
+        return FailingQueryApi()
+
+
+def _failing_influx_service():
+    # InfluxDBService without connecting: its client's queries all fail
+    service = InfluxDBService.__new__(InfluxDBService)
+    service.bucket = "b"
+    service.org = "o"
+    service.client = FailingClient()
+    service._client_cycle = itertools.cycle([service.client])
+    return service
+
+
+@pytest.mark.parametrize("count_only", [False, True])
+def test_failed_query_is_an_error_and_not_cached(monkeypatch, count_only):
+    monkeypatch.setattr(main, "API_CONFIG", {})
+    monkeypatch.setattr(data_routes, "_historical_cache", OrderedDict())
+    query = HistoricalQuery(start_time="2024-01-01T00:00:00Z", end_time="2024-01-02T00:00:00Z",
+                            count_only=count_only)
+    user = User(username="admin")
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(data_routes.get_historical_data(query, user, _failing_influx_service()))
+    assert exc_info.value.status_code == 500
+    assert not data_routes._historical_cache
@@ -0,0 +1,63 @@
+import itertools
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from api.services.influx_service import InfluxDBService
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeAggregatingQueryApi:
+    """Answers the aggregated, sorted query like InfluxDB: windows are aligned to the epoch and
+    each row is stamped with its window's stop, truncated to the range stop."""
+
+    def __init__(self, points):
+        self.points = points # (time, address, value)
+
+    def query_stream(self, query, org, params):
+        assert "aggregateWindow" in query
+        every = params["_aggregate_every"]
+        start, stop = params["_start"], params["_stop"]
+        windows = {}
+        for time, address, value in self.points:
+            if not start <= time < stop:
+                continue
+            window_stop = EPOCH + ((time - EPOCH) // every + 1) * every
+            windows.setdefault((min(window_stop, stop), address), []).append(value)
+        rows = sorted(windows.items())[params["_offset"]:params["_offset"] + params["_limit"]]
+        for (time, address), values in rows:
+            yield SimpleNamespace(values={
+                "_time": time, "_measurement": "modbus_data", "_field": "value",
+                "_value": sum(values) / len(values), "address": address, "result": "_result", "table": 0,
+            })
+
+
+def _service(query_api):
+    # InfluxDBService without connecting
+    service = InfluxDBService.__new__(InfluxDBService)
+    service.bucket = "b"
+    service.org = "o"
+    service.client = SimpleNamespace(query_api=lambda: query_api)
+    service._client_cycle = itertools.cycle([service.client])
+    return service
+
+
+def test_aggregated_pages_drop_and_repeat_no_rows():
+    # Three series with a point every 10s over 5 minutes, aggregated per minute
+    points = [(START + timedelta(seconds=s), str(address), s + address)
+              for s in range(0, 300, 10) for address in range(3)]
+    service = _service(FakeAggregatingQueryApi(points))
+    query = dict(start_time=START, end_time=START + timedelta(minutes=5), aggregate_every="1m")
+
+    everything, cursor = service.query_historical_data(limit=1000, **query)
+    assert cursor is None and len(everything) == 15
+
+    paged, cursor = [], None
+    while True:
+        # A page size that splits the series of a window across pages
+        page, cursor = service.query_historical_data(limit=2, cursor=cursor, **query)
+        paged.extend(page)
+        if cursor is None:
+            break
+    assert [(p.time, p.tags, p.fields) for p in paged] == [(p.time, p.tags, p.fields) for p in everything]
@@ -0,0 +1,31 @@
+import asyncio
+
+import orjson
+import pytest
+
+from api import main
+
+
+@pytest.fixture
+def ws_queue(monkeypatch):
+    queue = asyncio.Queue()
+    monkeypatch.setattr(main, "WS_QUEUE", queue)
+    return queue
+
+
+def _ws_value(queue, payload):
+    main.handle_mqtt_for_websockets("modbus/gateway/Device1/1/holding_registers/0", payload)
+    return orjson.loads(queue.get_nowait())["value"]
+
+
+@pytest.mark.parametrize("payload, value", [
+    ("42", 42),
+    ("-5", -5),
+    ("1.5", 1.5),
+    ("true", True),
+    ("--5", "--5"),
+    ("---1", "---1"),
+    ("abc", "abc"),
+])
+def test_payload_conversion(ws_queue, payload, value):
+    assert _ws_value(ws_queue, payload) == value
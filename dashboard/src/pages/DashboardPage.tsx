@@ -47,6 +47,9 @@ const DashboardPage: React.FC = () => {
     if (!isAuthenticated()) return; // Don't connect if not authenticated
 
     const socket = new WebSocket(API_WS_URL);
+    // The API sends UTF-8 JSON as binary frames; receive them as ArrayBuffer for decoding
+    socket.binaryType = 'arraybuffer';
+    const textDecoder = new TextDecoder();
     setWs(socket);
 
     socket.onopen = () => {
@@ -56,12 +59,15 @@ const DashboardPage: React.FC = () => {
 
     socket.onmessage = (event) => {
       try {
-        const message: RealTimeDataUpdate = JSON.parse(event.data as string);
-        // console.log('WebSocket message received:', message);
+        const text = typeof event.data === 'string' ? event.data : textDecoder.decode(event.data as ArrayBuffer);
+        // Frames carry a JSON array of updates (oldest first); accept a single object too
+        const parsed: RealTimeDataUpdate | RealTimeDataUpdate[] = JSON.parse(text);
+        const messages = Array.isArray(parsed) ? parsed : [parsed];
+        // console.log('WebSocket messages received:', messages);
         setRealTimeData(prevData => [
-          message, 
-          ...prevData.slice(0, 49) // Keep last 50 messages
-        ]);
+          ...messages.reverse(),
+          ...prevData
+        ].slice(0, 50)); // Keep last 50 messages
       } catch (e) {
         console.error('Failed to parse WebSocket message:', e);
       }
@@ -2,29 +2,51 @@ import yaml
 import time
 import logging
 import argparse
+import collections
+import heapq
+import itertools
+import select
 import json # For parsing control commands
+import signal
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
 from pymodbus.client import ModbusTcpClient
 from pymodbus.exceptions import ModbusIOException, ConnectionException
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import WriteOptions
 import paho.mqtt.client as mqtt
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# The format doesn't show thread or process details, so skip collecting them per record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logger = logging.getLogger(__name__)
 
 CONFIG = {}
-# Global Modbus client instance for access by MQTT command handler
-# This is a simple approach; in more complex scenarios, consider passing it around
-# or using a class structure that encapsulates both MQTT and Modbus clients.
-GLOBAL_MODBUS_CLIENT: ModbusTcpClient = None
+SLAVES = () # SlaveConfig per configured slave, parsed from CONFIG at startup
+# One Modbus connection per server (host, port), shared by the slaves behind it: Modbus
+# TCP gateways often accept only a few connections. Slaves on different servers are polled
+# in parallel; a connection's transactions are serialized by its ModbusLink's lock.
+MODBUS_LINK_POOL = {} # (host, port) -> ModbusLink
+MODBUS_LINKS = {} # slave_id -> its server's ModbusLink
+# Runs control writes, which block on Modbus I/O, off the main loop (set up in main_loop)
+CONTROL_EXECUTOR: ThreadPoolExecutor = None
+
+# libyaml's C parser when PyYAML was built with it; same safe semantics as yaml.safe_load
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 def load_gateway_config(config_file):
     """Loads gateway configuration from a YAML file."""
     global CONFIG
     try:
         with open(config_file, 'r') as f:
-            CONFIG = yaml.safe_load(f)
+            CONFIG = yaml.load(f, Loader=_YAML_LOADER)
         logger.info(f"Gateway configuration loaded from {config_file}")
         return True
     except FileNotFoundError:
@@ -34,24 +56,86 @@ def load_gateway_config(config_file):
         logger.error(f"Error parsing YAML file {config_file}: {e}")
         return False
 
+# Keepalive probing: start after 30 s idle, every 10 s, give up after 3 missed probes
+TCP_KEEPALIVE_OPTIONS = (('TCP_KEEPIDLE', 30), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3))
+
+def tune_modbus_socket(client):
+    """Disables Nagle's algorithm and enables keepalive on a connected client's socket.
+
+    Modbus requests are a few bytes each; with Nagle enabled, back-to-back reads can stall
+    on the peer's delayed ACK for tens of milliseconds.
+    """
+    sock = getattr(client, 'socket', None)
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in TCP_KEEPALIVE_OPTIONS:
+            if hasattr(socket, option): # Linux; not all platforms have these
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+    except OSError as e:
+        logger.warning(f"Could not set Modbus socket options: {e}")
+
 def connect_modbus_client(host, port):
     """Establishes a connection to the Modbus server."""
-    global GLOBAL_MODBUS_CLIENT
     client = ModbusTcpClient(host, port)
     try:
         if client.connect():
             logger.info(f"Successfully connected to Modbus server at {host}:{port}")
-            GLOBAL_MODBUS_CLIENT = client # Store the connected client globally
+            tune_modbus_socket(client)
             return client
         else:
             logger.error(f"Failed to connect to Modbus server at {host}:{port}")
-            GLOBAL_MODBUS_CLIENT = None
             return None
     except Exception as e: # Catch potential pymodbus or network errors
         logger.error(f"Exception during Modbus connection to {host}:{port}: {e}")
-        GLOBAL_MODBUS_CLIENT = None
         return None
 
+class ModbusLink:
+    """A Modbus server connection and the lock that serializes its transactions.
+
+    Polls (on the polling pool) and control writes (on the control worker) share the
+    connection; a pymodbus client isn't safe to use from two threads at once, so hold
+    lock while using client. The connection is considered up until a request fails with a
+    connection error (mark_lost), so it isn't probed before every transaction; the next
+    poll reconnects.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.client = None
+        self.alive = False
+        self.was_connected = False # Whether the connection has ever been up
+        self.lock = threading.Lock()
+
+    def ensure_connected(self):
+        """Connects if the connection is down. Call with lock held. Returns whether it's up."""
+        if not self.alive:
+            self.client = connect_modbus_client(self.host, self.port)
+            self.alive = self.client is not None
+            self.was_connected |= self.alive
+        return self.alive
+
+    def mark_lost(self):
+        """Closes a connection that failed, so the next poll reconnects. Call with lock held."""
+        if self.client:
+            self.client.close()
+        self.client = None
+        self.alive = False
+
+    def close(self):
+        with self.lock:
+            self.mark_lost()
+
+def get_modbus_link(host, port):
+    """Returns the pooled ModbusLink for a server, creating it on first use."""
+    link = MODBUS_LINK_POOL.get((host, port))
+    if link is None:
+        link = MODBUS_LINK_POOL[(host, port)] = ModbusLink(host, port)
+    return link
+
 def connect_influxdb_client(url, token, org):
     """Establishes a connection to InfluxDB."""
     try:
@@ -66,44 +150,93 @@ def connect_influxdb_client(url, token, org):
         logger.error(f"Exception connecting to InfluxDB: {e}")
         return None
 
+# The main loop collects the lines of every poll into one write of up to
+# INFLUX_MAX_LINES_PER_WRITE lines (see InfluxLineBuffer), so the client sends each write
+# as its own request, from its background thread: a poll never waits on an InfluxDB
+# round trip, and failed writes are retried.
+INFLUX_WRITE_OPTIONS = WriteOptions(
+    batch_size=1,
+    flush_interval=1_000,
+    jitter_interval=200,
+    retry_interval=5_000,
+    max_retries=5
+)
+
+def create_influxdb_write_api(influx_client):
+    """Creates the background write API shared by all polls. Closing it flushes pending writes."""
+    if not influx_client:
+        return None
+    return influx_client.write_api(write_options=INFLUX_WRITE_OPTIONS)
+
 # --- MQTT Control Command Handler ---
+try:
+    from orjson import loads as _json_loads # Parses the payload bytes directly, no decode() first
+except ImportError:
+    _json_loads = json.loads
 def on_control_command(client, userdata, msg):
     """Callback for handling control commands received via MQTT."""
-    global GLOBAL_MODBUS_CLIENT
     topic = msg.topic
-    payload_str = msg.payload.decode()
-    logger.info(f"Received control command on topic '{topic}': {payload_str}")
-
-    if not GLOBAL_MODBUS_CLIENT or not GLOBAL_MODBUS_CLIENT.is_socket_open():
-        logger.error("Modbus client is not connected. Cannot execute control command.")
-        # Optionally, publish a failure response back to MQTT here
-        return
+    payload = msg.payload
+    logger.info("Received control command on topic '%s': %r", topic, payload[:256])
 
     try:
-        command_data = json.loads(payload_str)
+        command_data = _json_loads(payload)
         slave_id = command_data.get('slave_id')
         register_type = command_data.get('register_type')
         address = command_data.get('address')
         value = command_data.get('value')
 
         if None in [slave_id, register_type, address, value]:
-            logger.error(f"Invalid command payload from {topic}: missing required fields. Payload: {payload_str}")
+            logger.error(f"Invalid command payload from {topic}: missing required fields. Payload: {payload[:256]!r}")
             return
 
-        logger.info(f"Executing Modbus write: Slave ID={slave_id}, Type={register_type}, Addr={address}, Value={value}")
+        link = MODBUS_LINKS.get(slave_id)
+        if link is None:
+            logger.error(f"Slave {slave_id} is not configured on this gateway. Cannot execute control command.")
+            return
+        if CONTROL_EXECUTOR is None:
+            logger.error("Gateway main loop is not running. Cannot execute control command.")
+            return
+        # This callback runs on the main loop; the write blocks on Modbus I/O (and possibly
+        # on a poll of the same slave), so it runs on a worker.
+        CONTROL_EXECUTOR.submit(_execute_locked_modbus_write, link, slave_id, register_type, address, value)
+
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError subclasses it
+        logger.error(f"Failed to decode JSON payload from {topic}: {e}. Payload: {payload[:256]!r}")
+    except Exception as e:
+        logger.error(f"Unexpected error processing control command from {topic}: {e}", exc_info=True)
+
+def _execute_locked_modbus_write(link, slave_id, register_type, address, value):
+    try:
+        with link.lock: # Don't interleave with a poll of the same slave
+            execute_modbus_write(link, slave_id, register_type, address, value)
+    except Exception as e:
+        logger.error(f"Unexpected error executing control command for slave {slave_id}: {e}", exc_info=True)
+
+def execute_modbus_write(link, slave_id, register_type, address, value):
+    """Writes a control command's value to a slave. Call with the link's lock held."""
+    modbus_client = link.client
+    if not link.alive:
+        logger.error(f"Modbus client for slave {slave_id} is not connected. Cannot execute control command.")
+        # Optionally, publish a failure response back to MQTT here
+        return
+
+    try:
+
+        logger.info("Executing Modbus write: Slave ID=%s, Type=%s, Addr=%s, Value=%s", slave_id, register_type, address, value)
         
         response = None
         if register_type == "coil":
             if not isinstance(value, bool):
                 logger.error(f"Invalid value type for coil: {type(value)}. Must be boolean.")
                 return
-            response = GLOBAL_MODBUS_CLIENT.write_coil(address, value, slave=slave_id)
+            response = modbus_client.write_coil(address, value, slave=slave_id)
         elif register_type == "holding_register":
             if not isinstance(value, int):
                 logger.error(f"Invalid value type for holding_register: {type(value)}. Must be integer.")
                 return
             # For writing a single holding register
-            response = GLOBAL_MODBUS_CLIENT.write_register(address, value, slave=slave_id)
+            response = modbus_client.write_register(address, value, slave=slave_id)
         else:
             logger.error(f"Unsupported register_type for write operation: {register_type}")
             return
@@ -114,27 +247,54 @@ def on_control_command(client, userdata, msg):
             logger.error(f"Modbus write error for {register_type} at {address} (Slave {slave_id}): {response}")
             # Optionally, publish a failure response back to MQTT
         else:
-            logger.info(f"Successfully wrote {register_type} at {address} (Slave {slave_id}) with value {value}. Response: {response}")
+            logger.info("Successfully wrote %s at %s (Slave %s) with value %s. Response: %s", register_type, address, slave_id, value, response)
             # Optionally, publish a success response back to MQTT
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to decode JSON payload from {topic}: {e}. Payload: {payload_str}")
     except ModbusIOException as e:
-        logger.error(f"Modbus IO Exception during write: {e}. Reconnecting Modbus client might be needed.")
-        # Potentially trigger a reconnect for GLOBAL_MODBUS_CLIENT here if connection is lost
+        logger.error(f"Modbus IO Exception during write: {e}. The next poll of slave {slave_id} reconnects.")
+        link.mark_lost()
     except ConnectionException as e:
         logger.error(f"Modbus Connection Exception during write: {e}. Modbus server might be down.")
-    except Exception as e:
-        logger.error(f"Unexpected error processing control command from {topic}: {e}", exc_info=True)
+        link.mark_lost()
+
+def _ignore_socket_event(client, userdata, sock):
+    pass
+
+def write_mqtt_burst(client):
+    """Writes out the publishes queued for a poll.
+
+    paho sends each queued packet with its own send(), so on Linux the socket is corked
+    meanwhile and the burst leaves in as few full TCP segments as possible. Elsewhere,
+    Nagle's algorithm (TCP_NODELAY is left off) merges the packets written after the first.
+    """
+    sock = client.socket()
+    cork = sock is not None and hasattr(socket, 'TCP_CORK')
+    if cork:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        except OSError:
+            cork = False
+    try:
+        client.loop_write()
+    finally:
+        if cork:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0) # Sends what's left
+            except OSError:
+                pass # loop_write closed the socket after a send error
 
 def connect_mqtt_client(broker_host, broker_port, client_id="modbus_gateway"):
-    """Establishes a connection to the MQTT broker and subscribes to topics."""
-    client = mqtt.Client(client_id=client_id)
+    """Creates the MQTT client and its subscriptions.
+
+    The connection itself is made (and remade after a disconnect) by MQTTDriver from the
+    main loop, so the broker not being up yet doesn't disable MQTT for the whole run.
+    """
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
     mqtt_config = CONFIG.get('mqtt', {})
     control_topic = mqtt_config.get('control_command_topic')
 
-    def on_connect(client, userdata, flags, rc):
-        if rc == 0:
+    def on_connect(client, userdata, flags, reason_code, properties):
+        if not reason_code.is_failure:
             logger.info(f"Successfully connected to MQTT broker at {broker_host}:{broker_port}")
             # Default subscription for data publishing (already handled by gateway logic)
             # No, gateway *publishes* data, API *subscribes*. Gateway does not subscribe to its own data topics.
@@ -146,9 +306,14 @@ def connect_mqtt_client(broker_host, broker_port, client_id="modbus_gateway"):
             else:
                 logger.warning("MQTT control_command_topic not defined in config. Gateway will not listen for write commands.")
         else:
-            logger.error(f"Failed to connect to MQTT broker, return code {rc}")
+            logger.error(f"Failed to connect to MQTT broker, reason: {reason_code}")
 
     client.on_connect = on_connect
+    # With a write callback registered, publish() only queues the packet instead of writing
+    # it to the socket right away; send_to_mqtt writes a poll's whole burst together with
+    # write_mqtt_burst(), and the main loop's select() finishes anything the socket didn't take.
+    # disconnect() is only queued too, so main_loop's shutdown writes it out itself.
+    client.on_socket_register_write = _ignore_socket_event
     # client.on_message = on_message # Default on_message if needed for other topics, otherwise remove if not used
 
     # Add specific callback for the control topic
@@ -156,243 +321,692 @@ def connect_mqtt_client(broker_host, broker_port, client_id="modbus_gateway"):
         client.message_callback_add(control_topic, on_control_command)
 
     try:
-        client.connect(broker_host, broker_port, 60)
-        client.loop_start() # Start a background thread for network traffic
-        logger.info(f"MQTT client '{client_id}' attempting to connect to {broker_host}:{broker_port}")
+        client.connect_async(broker_host, broker_port, 60)
+        logger.info(f"MQTT client '{client_id}' will connect to {broker_host}:{broker_port}")
         return client
     except Exception as e:
-        logger.error(f"Failed to connect to MQTT broker: {e}")
-        client.loop_stop()
+        logger.error(f"Failed to set up MQTT client: {e}")
         return None
 
-def poll_modbus_data(modbus_client, slave_config):
-    """Polls data from a Modbus slave device according to its configuration."""
-    if not modbus_client or not modbus_client.is_socket_open():
-        logger.warning("Modbus client is not connected or socket closed during poll. Skipping poll cycle.")
+# The main loop waits at most this long, so paho's housekeeping (keepalive pings,
+# QoS retries) and reconnects run regularly even when nothing else happens.
+MQTT_LOOP_MAX_WAIT_S = 1.0
+MQTT_RECONNECT_MIN_DELAY_S = 1
+MQTT_RECONNECT_MAX_DELAY_S = 120
+
+class MQTTDriver:
+    """Runs a paho client's network I/O from the gateway's main loop.
+
+    Used instead of loop_start(), so the gateway doesn't need a separate MQTT network
+    thread: the main loop waits on the MQTT socket together with poll completions. Only
+    the TCP connect, which blocks, runs on a helper thread; the main loop then finishes
+    the MQTT handshake (sends CONNECT, reads CONNACK) like any other traffic.
+    """
+    def __init__(self, client, wake=None):
+        self.client = client
+        self.wake = wake
+        self.reconnect_delay = MQTT_RECONNECT_MIN_DELAY_S
+        self.next_reconnect_at = 0.0
+        self.connecting = None # Future of the reconnect() running on connect_executor
+        self.connect_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mqtt-connect")
+
+    def wait(self, wakeup_sock, timeout):
+        """Waits up to timeout for MQTT traffic or the wakeup socket, handling MQTT I/O."""
+        client = self.client
+        read_socks = [wakeup_sock]
+        write_socks = []
+        # The client is left alone while a connect is in progress on the helper thread
+        sock = client.socket() if self.connecting is None else None
+        if sock is not None:
+            read_socks.append(sock)
+            if client.want_write():
+                write_socks.append(sock)
+        timeout = MQTT_LOOP_MAX_WAIT_S if timeout is None else max(0.0, min(timeout, MQTT_LOOP_MAX_WAIT_S))
+        readable, writable, _ = select.select(read_socks, write_socks, [], timeout)
+        if sock is not None:
+            if sock in readable:
+                client.loop_read() # Also runs callbacks, e.g. control commands
+            if sock in writable:
+                client.loop_write()
+        self.maintain()
+        return wakeup_sock in readable
+
+    def maintain(self):
+        """Reconnects with exponential backoff while disconnected, else runs paho's housekeeping."""
+        client = self.client
+        if self.connecting is not None:
+            if not self.connecting.done():
+                return
+            future, self.connecting = self.connecting, None
+            try:
+                future.result()
+                self.reconnect_delay = MQTT_RECONNECT_MIN_DELAY_S
+            except Exception as e:
+                logger.warning(f"MQTT connection failed: {e}. Retrying in {self.reconnect_delay}s.")
+                self.next_reconnect_at = time.monotonic() + self.reconnect_delay
+                self.reconnect_delay = min(self.reconnect_delay * 2, MQTT_RECONNECT_MAX_DELAY_S)
+                return
+        if client.socket() is not None:
+            client.loop_misc()
+            return
+        if time.monotonic() < self.next_reconnect_at:
+            return
+        # reconnect() only queues CONNECT (see on_socket_register_write); the main loop
+        # writes it once the socket is connected
+        self.connecting = self.connect_executor.submit(client.reconnect)
+        if self.wake:
+            self.connecting.add_done_callback(self.wake)
+
+    def close(self):
+        """Waits for a connect in progress, so the client can be used from this thread again."""
+        self.connect_executor.shutdown(wait=True)
+        self.connecting = None
+
+# Modbus limits per read request (PDU size): 125 registers or 2000 bits
+MAX_REGISTERS_PER_READ = 125
+MAX_BITS_PER_READ = 2000
+
+# reg_type -> (client read method, label used in logs, reads bits rather than registers, function code)
+_POLL_FUNCTIONS = (
+    ('holding_registers', 'read_holding_registers', 'HR', False, 0x03),
+    ('input_registers', 'read_input_registers', 'IR', False, 0x04),
+    ('coils', 'read_coils', 'Coils', True, 0x01),
+    ('discrete_inputs', 'read_discrete_inputs', 'DI', True, 0x02),
+)
+
+def coalesce_polls(polls, max_gap=0, max_count=MAX_REGISTERS_PER_READ):
+    """Merges configured reads that are adjacent or close into as few reads as possible.
+
+    Each Modbus request costs a network round trip, which dominates over the payload size.
+    With max_gap 0 only adjacent or overlapping reads merge; a larger gap lets one read
+    span up to that many unconfigured addresses, which many devices reject with an
+    exception response (Illegal Data Address) for the whole merged read. Returns
+    [{'address', 'count', 'subranges': [(address, count), ...]}] where subranges are the
+    original reads, to be sliced back out of the merged response.
+    """
+    merged = []
+    for poll in sorted(polls, key=lambda p: p['address']):
+        address, count = poll['address'], poll['count']
+        if merged:
+            current = merged[-1]
+            end = max(current['address'] + current['count'], address + count)
+            if address - (current['address'] + current['count']) <= max_gap and end - current['address'] <= max_count:
+                current['count'] = end - current['address']
+                current['subranges'].append((address, count))
+                continue
+        merged.append({'address': address, 'count': count, 'subranges': [(address, count)]})
+    return merged
+
+# Config classes. The config is parsed into these once at startup, so the polling and
+# sending paths use attribute access on fixed fields rather than dict lookups and .get()
+# defaults per poll. Slots are declared by hand: dataclass(slots=True) needs Python 3.10.
+
+@dataclass(frozen=True)
+class PollPlan:
+    """One (possibly coalesced) read request."""
+    __slots__ = ('address', 'count', 'subranges', 'request', 'registers_format', 'fallback')
+    address: int
+    count: int
+    subranges: Tuple[Tuple[int, int, int, bool], ...] # (address, offset into the read, count, send packed)
+    request: Optional[bytes] # Pre-built raw request after the transaction id, if the unit id fits a byte
+    registers_format: Optional[struct.Struct] # Unpacks a raw register response
+    # For a coalesced read, its configured reads as separate plans, read instead if the
+    # device answers the merged read with an exception response; empty otherwise
+    fallback: Tuple['PollPlan', ...]
+
+@dataclass(frozen=True)
+class SlaveConfig:
+    __slots__ = ('id', 'name', 'host', 'port', 'polling_interval_s', 'on_change_only', 'heartbeat_s',
+                 'deadband', 'raw_reads', 'reads')
+    id: int
+    name: str
+    host: str
+    port: int
+    polling_interval_s: float
+    on_change_only: bool
+    heartbeat_s: float
+    deadband: float
+    raw_reads: bool
+    # (reg_type, client read method, label, is_bits, plans), only for types with reads configured
+    reads: Tuple[Tuple[str, str, str, bool, Tuple[PollPlan, ...]], ...]
+
+def parse_slave_config(slave_cfg, modbus_config):
+    """Builds a slave's SlaveConfig, including its coalesced reads, from its config dict.
+
+    A slave can set its own host and port; otherwise those of modbus_config (the
+    modbus_server section) apply.
+    """
+    slave_id = slave_cfg['id']
+    registers_to_poll = slave_cfg.get('registers_to_poll', {})
+    max_gap = slave_cfg.get('coalesce_max_gap', 0)
+    # Coil reads are sent packed as one bitfield unless marked export_individually
+    individual_coils = {poll['address'] for poll in registers_to_poll.get('coils', []) if poll.get('export_individually')}
+    raw_capable = isinstance(slave_id, int) and 0 <= slave_id <= 255 # Unit id is a single byte
+
+    def plan(reg_type, function_code, is_bits, address, count, subranges, fallback=()):
+        return PollPlan(
+            address=address,
+            count=count,
+            subranges=tuple((sub_address, sub_address - address, sub_count,
+                             reg_type == 'coils' and sub_address not in individual_coils)
+                            for sub_address, sub_count in subranges),
+            request=_REQUEST_TAIL.pack(0, 6, slave_id, function_code, address, count) if raw_capable else None,
+            registers_format=None if is_bits else struct.Struct(f">{count}H"),
+            fallback=fallback,
+        )
+
+    reads = []
+    for reg_type, method_name, label, is_bits, function_code in _POLL_FUNCTIONS:
+        plans = []
+        for poll in coalesce_polls(registers_to_poll.get(reg_type, []), max_gap=max_gap,
+                                   max_count=MAX_BITS_PER_READ if is_bits else MAX_REGISTERS_PER_READ):
+            subranges = poll['subranges']
+            fallback = ()
+            if len(subranges) > 1:
+                fallback = tuple(plan(reg_type, function_code, is_bits, sub_address, sub_count,
+                                      ((sub_address, sub_count),))
+                                 for sub_address, sub_count in subranges)
+            plans.append(plan(reg_type, function_code, is_bits, poll['address'], poll['count'], subranges, fallback))
+        if plans:
+            reads.append((reg_type, method_name, label, is_bits, tuple(plans)))
+    return SlaveConfig(
+        id=slave_id,
+        name=slave_cfg['name'],
+        host=slave_cfg.get('host', modbus_config.get('host')),
+        port=slave_cfg.get('port', modbus_config.get('port')),
+        polling_interval_s=slave_cfg.get('polling_interval_seconds', 10),
+        on_change_only=slave_cfg.get('on_change_only', False),
+        heartbeat_s=slave_cfg.get('heartbeat_seconds', 60),
+        deadband=slave_cfg.get('deadband', 0),
+        raw_reads=modbus_config.get('raw_reads', True),
+        reads=tuple(reads),
+    )
+
+def parse_slave_configs(config):
+    """Parses every configured slave into a SlaveConfig."""
+    modbus_config = config.get('modbus_server', {})
+    return tuple(parse_slave_config(slave_cfg, modbus_config) for slave_cfg in modbus_config.get('slaves', []))
+
+def pack_bits(bits):
+    """Packs booleans into bytes, first bit in the least significant bit (Modbus wire order)."""
+    packed = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            packed[i >> 3] |= 1 << (i & 7)
+    return bytes(packed)
+
+# Raw reads: the polled reads are fixed by the config, so their requests are built once
+# (see parse_slave_config) and written straight to the client's socket, and the fixed-layout
+# responses are unpacked with struct. This skips pymodbus's per-request objects and framer.
+# Writes still go through pymodbus.
+_TRANSACTION_ID = struct.Struct(">H")
+_REQUEST_TAIL = struct.Struct(">HHBBHH") # protocol id, length, unit id, function code, address, count
+_RESPONSE_HEADER = struct.Struct(">HHHBBB") # transaction id, protocol id, length, unit id, function code, byte count
+_transaction_ids = itertools.count(1)
+# Byte value -> its 8 bits, least significant first
+_BYTE_BITS = [tuple(bool(byte >> i & 1) for i in range(8)) for byte in range(256)]
+
+class ModbusExceptionResponse(Exception):
+    """The device answered a read with a Modbus exception response; the connection is fine."""
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionException("Modbus connection closed by the server")
+        received += n
+    return buffer
+
+def raw_read(sock, poll, is_bits):
+    """Runs a coalesced read (with its pre-built request) directly on the socket.
+
+    Returns the values like pymodbus does (bits padded to a multiple of 8). Raises
+    ModbusIOException if the response doesn't frame as expected, leaving the connection
+    unusable, and ModbusExceptionResponse on a Modbus exception response.
+    """
+    request = poll.request
+    count = poll.count
+    tid = next(_transaction_ids) & 0xFFFF
+    sock.sendall(_TRANSACTION_ID.pack(tid) + request)
+    r_tid, protocol, length, _, function_code, byte_count = _RESPONSE_HEADER.unpack(_recv_exactly(sock, 9))
+    if r_tid != tid or protocol != 0 or function_code & 0x7F != request[5]:
+        raise ModbusIOException(f"Unexpected response header (transaction {r_tid}, function {function_code})")
+    if function_code & 0x80: # The last header byte is the exception code
+        raise ModbusExceptionResponse(f"Modbus exception response, code {byte_count}")
+    expected = (count + 7) // 8 if is_bits else 2 * count
+    if byte_count != expected or length != byte_count + 3:
+        raise ModbusIOException(f"Unexpected response length ({byte_count} bytes for {count} values)")
+    data = _recv_exactly(sock, byte_count)
+    if is_bits:
+        byte_bits = _BYTE_BITS
+        return [bit for byte in data for bit in byte_bits[byte]]
+    return list(poll.registers_format.unpack(data))
+
+def read_plan(read, sock, poll, is_bits, slave_id):
+    """Runs one planned read, raw on sock if given, else with the client's read method.
+
+    Returns the values (bits padded to a multiple of 8). Raises ModbusExceptionResponse on
+    an exception response, and the pymodbus exceptions when the connection needs a reconnect.
+    """
+    if sock is not None and poll.request is not None:
+        return raw_read(sock, poll, is_bits)
+    rr = read(poll.address, poll.count, slave=slave_id)
+    if rr.isError():
+        if isinstance(rr, (ModbusIOException, ConnectionException)):
+            raise rr
+        raise ModbusExceptionResponse(str(rr))
+    return rr.bits if is_bits else rr.registers
+
+def poll_modbus_data(modbus_client, slave):
+    """Polls data from a Modbus slave device according to its SlaveConfig."""
+    if not modbus_client:
+        logger.warning("Modbus client is not connected during poll. Skipping poll cycle.")
         return None # Indicate failure or inability to poll
         
-    slave_id = slave_config['id']
-    polled_data = {"device_name": slave_config['name'], "slave_id": slave_id, "registers": {}}
-    logger.info(f"Polling data from slave {slave_id} ({slave_config['name']})")
+    slave_id = slave.id
+    registers = {}
+    polled_data = {"device_name": slave.name, "slave_id": slave_id, "registers": registers}
+    logger.info("Polling data from slave %s (%s)", slave_id, slave.name)
+    # Log arguments below (slices of the values) are only built when debug logging is on
+    debug = logger.isEnabledFor(logging.DEBUG)
 
-    registers_to_poll = slave_config.get('registers_to_poll', {})
-    connection_error_occurred = False
+    # pymodbus's own path is used when raw reads are disabled or the socket isn't exposed
+    sock = getattr(modbus_client, 'socket', None) if slave.raw_reads else None
+    if sock is not None:
+        # pymodbus leaves the socket non-blocking after its own requests (the control writes)
+        comm_params = getattr(modbus_client, 'comm_params', None)
+        sock.settimeout(getattr(comm_params, 'timeout_connect', None) or 3)
 
-    # Holding Registers (FC=0x03)
-    for hr_poll in registers_to_poll.get('holding_registers', []):
-        address = hr_poll['address']
-        count = hr_poll['count']
-        try:
-            rr = modbus_client.read_holding_registers(address, count, slave=slave_id)
-            if rr.isError():
-                logger.warning(f"Modbus error reading holding registers from slave {slave_id} at {address}: {rr}")
-                if isinstance(rr, (ModbusIOException, ConnectionException)):
-                    connection_error_occurred = True; break
-            else:
-                polled_data["registers"].setdefault("holding_registers", {})[address] = rr.registers
-                logger.debug(f"Read HR from {slave_id} @{address}: {rr.registers}")
-        except (ModbusIOException, ConnectionException) as e:
-            logger.error(f"Modbus Connection/IO Exception (HR) for slave {slave_id} at {address}: {e}")
-            connection_error_occurred = True; break
-        except Exception as e:
-            logger.error(f"Exception reading holding registers from slave {slave_id} at {address}: {e}")
-    if connection_error_occurred: return None # Signal to attempt reconnect
-    
-    # Input Registers (FC=0x04)
-    for ir_poll in registers_to_poll.get('input_registers', []):
-        address = ir_poll['address']
-        count = ir_poll['count']
-        try:
-            rr = modbus_client.read_input_registers(address, count, slave=slave_id)
-            if rr.isError():
-                logger.warning(f"Modbus error reading input registers from slave {slave_id} at {address}: {rr}")
-                if isinstance(rr, (ModbusIOException, ConnectionException)):
-                    connection_error_occurred = True; break
-            else:
-                polled_data["registers"].setdefault("input_registers", {})[address] = rr.registers
-                logger.debug(f"Read IR from {slave_id} @{address}: {rr.registers}")
-        except (ModbusIOException, ConnectionException) as e:
-            logger.error(f"Modbus Connection/IO Exception (IR) for slave {slave_id} at {address}: {e}")
-            connection_error_occurred = True; break
-        except Exception as e:
-            logger.error(f"Exception reading input registers from slave {slave_id} at {address}: {e}")
-    if connection_error_occurred: return None
-
-    # Coils (FC=0x01)
-    for coil_poll in registers_to_poll.get('coils', []):
-        address = coil_poll['address']
-        count = coil_poll['count']
-        try:
-            rr = modbus_client.read_coils(address, count, slave=slave_id)
-            if rr.isError():
-                logger.warning(f"Modbus error reading coils from slave {slave_id} at {address}: {rr}")
-                if isinstance(rr, (ModbusIOException, ConnectionException)):
-                    connection_error_occurred = True; break
-            else:
-                polled_data["registers"].setdefault("coils", {})[address] = rr.bits[:count] # Only take requested bits
-                logger.debug(f"Read Coils from {slave_id} @{address}: {rr.bits[:count]}")
-        except (ModbusIOException, ConnectionException) as e:
-            logger.error(f"Modbus Connection/IO Exception (Coils) for slave {slave_id} at {address}: {e}")
-            connection_error_occurred = True; break
-        except Exception as e:
-            logger.error(f"Exception reading coils from slave {slave_id} at {address}: {e}")
-    if connection_error_occurred: return None
-
-    # Discrete Inputs (FC=0x02)
-    for di_poll in registers_to_poll.get('discrete_inputs', []):
-        address = di_poll['address']
-        count = di_poll['count']
-        try:
-            rr = modbus_client.read_discrete_inputs(address, count, slave=slave_id)
-            if rr.isError():
-                logger.warning(f"Modbus error reading discrete inputs from slave {slave_id} at {address}: {rr}")
-                if isinstance(rr, (ModbusIOException, ConnectionException)):
-                    connection_error_occurred = True; break
-            else:
-                polled_data["registers"].setdefault("discrete_inputs", {})[address] = rr.bits[:count]
-                logger.debug(f"Read DI from {slave_id} @{address}: {rr.bits[:count]}")
-        except (ModbusIOException, ConnectionException) as e:
-            logger.error(f"Modbus Connection/IO Exception (DI) for slave {slave_id} at {address}: {e}")
-            connection_error_occurred = True; break
-        except Exception as e:
-            logger.error(f"Exception reading discrete inputs from slave {slave_id} at {address}: {e}")
-    if connection_error_occurred: return None
+    for reg_type, method_name, label, is_bits, plans in slave.reads:
+        read = getattr(modbus_client, method_name)
+        by_address = registers[reg_type] = {}
+        pending = collections.deque(plans)
+        while pending:
+            poll = pending.popleft()
+            address = poll.address
+            count = poll.count
+            try:
+                try:
+                    values = read_plan(read, sock, poll, is_bits, slave_id)
+                except ModbusExceptionResponse as e:
+                    if not poll.fallback:
+                        logger.warning(f"Modbus error reading {reg_type.replace('_', ' ')} from slave {slave_id} at {address}: {e}")
+                        continue
+                    # Read the configured ranges one by one, so only those the device
+                    # rejects themselves are missing
+                    logger.warning(f"Modbus error on the merged {label} read from slave {slave_id} at {address} "
+                                   f"(count {count}): {e}; reading its {len(poll.fallback)} configured ranges separately")
+                    pending.extendleft(reversed(poll.fallback))
+                    continue
+                # Split the merged read back into the configured reads
+                for sub_address, offset, sub_count, packed in poll.subranges:
+                    sub_values = values[offset:offset + sub_count]
+                    by_address[sub_address] = pack_bits(sub_values) if packed else sub_values
+                if debug:
+                    logger.debug("Read %s from %s @%s: %s", label, slave_id, address, values[:count])
+            except (ModbusIOException, ConnectionException, OSError) as e:
+                logger.error(f"Modbus Connection/IO Exception ({label}) for slave {slave_id} at {address}: {e}")
+                return None # Signal to attempt reconnect
+            except Exception as e:
+                logger.error(f"Exception reading {reg_type.replace('_', ' ')} from slave {slave_id} at {address}: {e}")
+        if not by_address: # Every read of this type failed
+            del registers[reg_type]
 
     return polled_data
 
-def send_to_influxdb(influx_client, data, bucket, org):
-    """Sends polled data to InfluxDB."""
-    if not influx_client:
-        logger.warning("InfluxDB client not available. Skipping data send.")
-        return
-    
-    write_api = influx_client.write_api(write_options=SYNCHRONOUS)
+# Line protocol tag values escape commas, equals signs and spaces with a backslash
+_TAG_ESCAPES = str.maketrans({',': '\\,', '=': '\\=', ' ': '\\ '})
+
+def _escape_tag(value):
+    return str(value).translate(_TAG_ESCAPES)
+
+def _format_field_value(value):
+    """Formats a register value as a line protocol field value."""
+    if isinstance(value, bool): # Before int: bool is a subclass of int
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def format_bits(packed):
+    """Formats a packed bitfield (see pack_bits) as sent to InfluxDB and MQTT."""
+    return "0x" + packed.hex()
+
+# Escaped tag set between the address and the value of a line, per (device_name, slave_id,
+# reg_type). These are fixed by the config, so each is built once. Only used from the main
+# thread. -> (line_middle, bits_middle)
+_LINE_TEMPLATES = {}
+
+def _line_template(device_name, slave_id, reg_type):
+    # The tag set is written in key order: address, device_name, register_type, slave_id
+    tags = f",device_name={_escape_tag(device_name)},register_type={_escape_tag(reg_type)},slave_id={_escape_tag(slave_id)}"
+    template = _LINE_TEMPLATES[(device_name, slave_id, reg_type)] = (f"{tags} value=", f"{tags} value_bits=")
+    return template
+
+def build_influx_lines(data, points):
+    """Appends polled data's line protocol lines to points."""
     device_name = data['device_name']
     slave_id = data['slave_id']
     # Ensure timestamp is created when data is actually polled, or use InfluxDB server time.
     # For consistency, if data dict has a timestamp, use it. Otherwise, generate now.
     timestamp = data.get('timestamp', int(time.time() * 1e9)) # Nanosecond precision
 
-    points = []
+    # Format line protocol directly rather than building a Point per value. Only the
+    # address and value change per line; the rest comes from the cached template.
+    # Bound once: the inner loop runs per register value
+    append = points.append
+    format_value = _format_field_value
+    get_template = _LINE_TEMPLATES.get
     for reg_type, registers_at_start_addr in data.get('registers', {}).items():
+        template = get_template((device_name, slave_id, reg_type)) or _line_template(device_name, slave_id, reg_type)
+        line_middle, bits_middle = template
         for start_addr, values_list in registers_at_start_addr.items():
             if isinstance(values_list, list):
                 for i, value_item in enumerate(values_list):
-                    current_addr = start_addr + i
-                    point = (
-                        Point("modbus_data")
-                        .tag("device_name", device_name)
-                        .tag("slave_id", str(slave_id))
-                        .tag("register_type", reg_type)
-                        .tag("address", str(current_addr))
-                        .field("value", value_item) # Ensure value_item is of appropriate type for InfluxDB
-                        .time(timestamp, WritePrecision.NS)
-                    )
-                    points.append(point)
+                    if value_item is None: # Unchanged since last sent
+                        continue
+                    append(f"modbus_data,address={start_addr + i}{line_middle}{format_value(value_item)} {timestamp}")
+            elif isinstance(values_list, bytes): # Packed coils: one string field for the block
+                append(f"modbus_data,address={start_addr}{bits_middle}\"{format_bits(values_list)}\" {timestamp}")
+            elif values_list is None: # Unchanged since last sent
+                continue
             else: 
                 logger.warning(f"Unexpected data format for InfluxDB (values not a list): {values_list} for {reg_type} @ {start_addr}")
 
-    if points:
-        try:
-            write_api.write(bucket=bucket, org=org, record=points)
-            logger.info(f"Successfully wrote {len(points)} points to InfluxDB for {device_name} (Slave ID: {slave_id})")
-        except Exception as e:
-            logger.error(f"Error writing to InfluxDB: {e}")
-    else:
-        logger.debug("No data points to send to InfluxDB.")
+# InfluxDB handles writes of a few thousand lines best; much larger requests risk timeouts
+INFLUX_MAX_LINES_PER_WRITE = 5000
+# How long polled lines may wait for other polls' lines before they're written anyway
+INFLUX_FLUSH_INTERVAL_S = 1.0
 
-def send_to_mqtt(mqtt_client, data, topic_prefix):
-    """Sends polled data to MQTT."""
+class InfluxLineBuffer:
+    """Collects the line protocol lines of polls across slaves into shared writes.
+
+    Rather than one write per slave poll, the main loop adds each poll's lines here and
+    calls flush_due: lines are written once INFLUX_MAX_LINES_PER_WRITE have built up, or
+    INFLUX_FLUSH_INTERVAL_S after the oldest arrived. Only used from the main thread.
+    """
+
+    def __init__(self, write_api, bucket, org):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.lines = []
+        self.flush_at = None # Monotonic deadline for the lines buffered so far
+
+    def add(self, data):
+        if self.flush_at is None:
+            self.flush_at = time.monotonic() + INFLUX_FLUSH_INTERVAL_S
+        build_influx_lines(data, self.lines)
+
+    def flush_due(self, now):
+        if self.lines and (len(self.lines) >= INFLUX_MAX_LINES_PER_WRITE or now >= self.flush_at):
+            self.flush()
+
+    def flush(self):
+        lines = self.lines
+        self.lines = []
+        self.flush_at = None
+        for start in range(0, len(lines), INFLUX_MAX_LINES_PER_WRITE):
+            chunk = lines[start:start + INFLUX_MAX_LINES_PER_WRITE]
+            try:
+                # One newline-separated bytes record per request
+                self.write_api.write(bucket=self.bucket, org=self.org, record="\n".join(chunk).encode(),
+                                     write_precision=WritePrecision.NS)
+                logger.info("Queued %d points for InfluxDB", len(chunk))
+            except Exception as e:
+                logger.error(f"Error writing to InfluxDB: {e}")
+
+# The set of topics is fixed by the config, so each is formatted once and reused on every
+# poll. Only used from the main thread. (topic_prefix, device_name, slave_id) -> {(reg_type, address): topic}
+_TOPIC_CACHE = {}
+
+# MQTT payload formatter per register type: bit reads hold bools, register reads ints, so
+# the type is known up front instead of checked per value. Payloads are bytes, which paho
+# sends as is.
+_BOOL_PAYLOADS = {True: b"true", False: b"false"}
+_format_bool_payload = _BOOL_PAYLOADS.__getitem__
+
+def _format_int_payload(value):
+    return b"%d" % value
+
+_PAYLOAD_FORMATTERS = {reg_type: _format_bool_payload if is_bits else _format_int_payload
+                       for reg_type, _, _, is_bits, _ in _POLL_FUNCTIONS}
+
+def send_to_mqtt(mqtt_client, data, topic_prefix, qos=0, retain=False):
+    """Sends polled data to MQTT.
+
+    Data defaults to QoS 0: every poll republishes the current values, so a lost message
+    is superseded by the next one, while QoS 1 costs a PUBACK per value.
+    """
     if not mqtt_client or not mqtt_client.is_connected():
         logger.warning("MQTT client not connected. Skipping data send.")
         return
 
     device_name = data['device_name']
     slave_id = data['slave_id']
+    topics = _TOPIC_CACHE.setdefault((topic_prefix, device_name, slave_id), {})
+    # Bound once: the inner loop runs per register value
+    get_topic = topics.get
+    publish = mqtt_client.publish
+    debug = logger.isEnabledFor(logging.DEBUG) # Checked once, not per value
 
     for reg_type, registers_at_start_addr in data.get('registers', {}).items():
+        format_payload = _PAYLOAD_FORMATTERS.get(reg_type, str)
         for start_addr, values_list in registers_at_start_addr.items():
             if isinstance(values_list, list):
                 for i, value_item in enumerate(values_list):
+                    if value_item is None: # Unchanged since last sent
+                        continue
                     current_addr = start_addr + i
-                    topic = f"{topic_prefix}/{device_name}/{slave_id}/{reg_type}/{current_addr}"
+                    topic = get_topic((reg_type, current_addr))
+                    if topic is None:
+                        topic = topics[(reg_type, current_addr)] = f"{topic_prefix}/{device_name}/{slave_id}/{reg_type}/{current_addr}"
                     try:
-                        # Ensure payload is string. Bools and numbers need conversion.
-                        if isinstance(value_item, bool):
-                            payload = str(value_item).lower() # true/false
-                        else:
-                            payload = str(value_item)
-                        
-                        mqtt_client.publish(topic, payload, qos=1)
-                        logger.debug(f"Published to MQTT topic {topic}: {payload}")
+                        payload = format_payload(value_item)
+                        publish(topic, payload, qos=qos, retain=retain)
+                        if debug:
+                            logger.debug("Published to MQTT topic %s: %s", topic, payload)
                     except Exception as e:
                         logger.error(f"Error publishing to MQTT topic {topic}: {e}")
+            elif isinstance(values_list, bytes): # Packed coils: one message for the block
+                topic = get_topic((reg_type, start_addr))
+                if topic is None:
+                    topic = topics[(reg_type, start_addr)] = f"{topic_prefix}/{device_name}/{slave_id}/{reg_type}/{start_addr}"
+                try:
+                    publish(topic, format_bits(values_list), qos=qos, retain=retain)
+                except Exception as e:
+                    logger.error(f"Error publishing to MQTT topic {topic}: {e}")
+            elif values_list is None: # Unchanged since last sent
+                continue
             else:
                 logger.warning(f"Unexpected data format for MQTT (values not a list): {values_list} for {reg_type} @ {start_addr}")
-    logger.info(f"Data for {device_name} (Slave ID: {slave_id}) processed for MQTT.")
+    write_mqtt_burst(mqtt_client) # Publishes were only queued; write them out together
+    logger.info("Data for %s (Slave ID: %s) processed for MQTT.", device_name, slave_id)
 
-def main_loop(modbus_client_conn, influx_client, mqtt_client):
-    """Main polling loop for the gateway."""
-    global GLOBAL_MODBUS_CLIENT # Ensure we update this if reconnecting
-    GLOBAL_MODBUS_CLIENT = modbus_client_conn # Initial assignment
+def poll_slave(slave):
+    """Polls one slave over its server's shared connection, reconnecting first if needed.
 
-    modbus_config = CONFIG.get('modbus_server', {})
-    slaves = modbus_config.get('slaves', [])
-    influx_config = CONFIG.get('influxdb', {})
+    Runs on the polling thread pool. Returns the polled data, or None if the slave
+    couldn't be polled (the connection is closed so the next poll reconnects).
+    """
+    slave_id = slave.id
+    link = MODBUS_LINKS[slave_id]
+    with link.lock:
+        if not link.alive:
+            if link.was_connected: # Not on the first connect
+                logger.warning(f"Modbus client for slave {slave_id} disconnected. Attempting to reconnect...")
+            if not link.ensure_connected():
+                logger.error(f"Modbus reconnection for slave {slave_id} failed. Will retry on its next poll.")
+                return None
+
+        timestamp = time.time_ns()
+        polled_data = poll_modbus_data(link.client, slave)
+        if polled_data is None: # Indicates a connection error during poll
+            logger.warning(f"Polling slave {slave_id} failed due to connection issue. Reconnecting on its next poll.")
+            link.mark_lost()
+            return None
+        polled_data['timestamp'] = timestamp
+        return polled_data
+
+# Last value sent per (slave_id, reg_type, address), as (value, monotonic time sent).
+# Only used from the main thread.
+_last_emitted = {}
+
+def filter_changes(polled_data, slave):
+    """Blanks out (sets to None) values that haven't changed since they were last sent.
+
+    Enabled per slave with on_change_only. A value is still resent after heartbeat_seconds
+    so consumers see it's alive; numeric changes within deadband count as unchanged. The
+    senders skip None values.
+    """
+    if not slave.on_change_only:
+        return
+    heartbeat_s = slave.heartbeat_s
+    deadband = slave.deadband
+    now = time.monotonic()
+    slave_id = polled_data['slave_id']
+    for reg_type, registers_at_start_addr in polled_data['registers'].items():
+        for start_addr, values_list in registers_at_start_addr.items():
+            if isinstance(values_list, bytes): # Packed coils change (and are sent) as a block
+                key = (slave_id, reg_type, start_addr)
+                last = _last_emitted.get(key)
+                if last is not None and now - last[1] < heartbeat_s and values_list == last[0]:
+                    registers_at_start_addr[start_addr] = None
+                else:
+                    _last_emitted[key] = (values_list, now)
+                continue
+            for i, value in enumerate(values_list):
+                key = (slave_id, reg_type, start_addr + i)
+                last = _last_emitted.get(key)
+                if last is not None and now - last[1] < heartbeat_s:
+                    last_value = last[0]
+                    if value == last_value or (deadband and not isinstance(value, bool)
+                                               and abs(value - last_value) <= deadband):
+                        values_list[i] = None
+                        continue
+                _last_emitted[key] = (value, now)
+
+def dispatch_polled_data(polled_data, slave, influx_lines, mqtt_client):
+    """Sends a poll's data to MQTT and buffers it for InfluxDB. Runs on the main thread only."""
     mqtt_config = CONFIG.get('mqtt', {})
+    if polled_data and polled_data.get('registers'):
+        filter_changes(polled_data, slave)
+        if influx_lines is not None:
+            influx_lines.add(polled_data)
+        if mqtt_client and mqtt_config:
+            send_to_mqtt(mqtt_client, polled_data, mqtt_config['topic_prefix'],
+                         qos=mqtt_config.get('data_qos', 0), retain=mqtt_config.get('data_retain', False))
+
+def main_loop(influx_client, mqtt_client, influx_write_api=None):
+    """Main polling loop for the gateway. Also drives the MQTT client's network I/O."""
+    global CONTROL_EXECUTOR
+    slaves = SLAVES or parse_slave_configs(CONFIG)
 
     if not slaves:
         logger.warning("No Modbus slaves configured to poll. Exiting loop.")
         return
 
-    last_poll_times = {slave['id']: 0 for slave in slaves}
+    for slave in slaves:
+        MODBUS_LINKS[slave.id] = get_modbus_link(slave.host, slave.port)
+
+    # Polls are network waits, so one thread per slave lets a slow slave delay only the
+    # slaves sharing its server connection. Results come back to this thread, which does all InfluxDB/MQTT sending.
+    executor = ThreadPoolExecutor(max_workers=len(slaves), thread_name_prefix="modbus-poll")
+    CONTROL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="modbus-control")
+    in_flight = {} # future -> (slave index, due time)
+    influx_config = CONFIG.get('influxdb', {})
+    if influx_write_api and influx_config:
+        influx_lines = InfluxLineBuffer(influx_write_api, influx_config['bucket'], influx_config['org'])
+    else:
+        if influx_write_api is None:
+            logger.warning("InfluxDB client not available. Polled data won't be stored.")
+        influx_lines = None
+    # Finished polls write a byte here to wake the main loop's select()
+    wakeup_recv, wakeup_send = socket.socketpair()
+    wakeup_recv.setblocking(False)
+    wakeup_send.setblocking(False)
+
+    def wake_main_loop(_future):
+        try:
+            wakeup_send.send(b'\0')
+        except OSError: # Buffer full: a wakeup is already pending
+            pass
+    mqtt_driver = MQTTDriver(mqtt_client, wake=wake_main_loop) if mqtt_client else None
+    # Min-heap of (due time, slave index) on the monotonic clock. The loop sleeps exactly
+    # until the next poll is due (or one finishes) instead of ticking and scanning all
+    # slaves. A slave is rescheduled when its poll completes, so it's never polled twice
+    # at once.
+    start = time.monotonic()
+    schedule = [(start, index) for index in range(len(slaves))]
+    heapq.heapify(schedule)
 
     try:
         while True:
-            current_time = time.time()
-            for slave_cfg in slaves:
-                slave_id = slave_cfg['id']
-                polling_interval = slave_cfg.get('polling_interval_seconds', 10)
-                if current_time - last_poll_times.get(slave_id, 0) >= polling_interval:
-                    if not GLOBAL_MODBUS_CLIENT or not GLOBAL_MODBUS_CLIENT.is_socket_open():
-                        logger.warning("Modbus client disconnected. Attempting to reconnect...")
-                        # Reassign to GLOBAL_MODBUS_CLIENT as well
-                        GLOBAL_MODBUS_CLIENT = connect_modbus_client(modbus_config.get('host'), modbus_config.get('port'))
-                        if not GLOBAL_MODBUS_CLIENT:
-                            logger.error("Modbus reconnection failed. Will retry in next cycle.")
-                            time.sleep(polling_interval) # Wait before retrying connection for this slave
-                            continue # Skip this poll cycle for this slave
-                    
-                    polled_data = poll_modbus_data(GLOBAL_MODBUS_CLIENT, slave_cfg)
-                    
-                    if polled_data is None: # Indicates a connection error during poll
-                        logger.warning(f"Polling slave {slave_id} failed due to connection issue. Attempting Modbus reconnect.")
-                        if GLOBAL_MODBUS_CLIENT: GLOBAL_MODBUS_CLIENT.close() # Close faulty client
-                        GLOBAL_MODBUS_CLIENT = connect_modbus_client(modbus_config.get('host'), modbus_config.get('port'))
-                        if not GLOBAL_MODBUS_CLIENT:
-                             logger.error("Modbus reconnection attempt failed. Will retry later.")
-                             time.sleep(polling_interval) 
-                        continue # Move to next slave or wait for next global cycle
-
-                    if polled_data and polled_data.get('registers'):
-                        polled_data['timestamp'] = int(current_time * 1e9) # Add timestamp to data dict
-                        if influx_client and influx_config:
-                            send_to_influxdb(influx_client, polled_data, influx_config['bucket'], influx_config['org'])
-                        if mqtt_client and mqtt_config:
-                            send_to_mqtt(mqtt_client, polled_data, mqtt_config['topic_prefix'])
-                    last_poll_times[slave_id] = current_time
-            
-            time.sleep(1) 
+            now = time.monotonic()
+            while schedule and schedule[0][0] <= now:
+                due, index = heapq.heappop(schedule)
+                future = executor.submit(poll_slave, slaves[index])
+                in_flight[future] = (index, due)
+                future.add_done_callback(wake_main_loop)
+
+            # Sleeps until the next poll is due, a poll finishes (so its data is sent right
+            # away), buffered InfluxDB lines are due, or MQTT traffic arrives
+            timeout = schedule[0][0] - now if schedule else None
+            if influx_lines is not None and influx_lines.flush_at is not None:
+                flush_in = max(influx_lines.flush_at - now, 0)
+                timeout = flush_in if timeout is None else min(timeout, flush_in)
+            if mqtt_driver:
+                woken = mqtt_driver.wait(wakeup_recv, timeout)
+            else:
+                woken = bool(select.select([wakeup_recv], [], [], timeout)[0])
+            if woken:
+                try:
+                    wakeup_recv.recv(4096)
+                except BlockingIOError:
+                    pass
+            done = [future for future in in_flight if future.done()]
+            for future in done:
+                index, due = in_flight.pop(future)
+                slave = slaves[index]
+                # Keep the cadence from the scheduled time; if a poll overran, go again now
+                next_due = due + slave.polling_interval_s
+                heapq.heappush(schedule, (max(next_due, time.monotonic()), index))
+                try:
+                    polled_data = future.result()
+                except Exception as e:
+                    logger.error(f"Unexpected error polling slave {slave.id}: {e}", exc_info=True)
+                    continue
+                dispatch_polled_data(polled_data, slave, influx_lines, mqtt_client)
+            if influx_lines is not None:
+                influx_lines.flush_due(time.monotonic())
     except KeyboardInterrupt:
         logger.info("Gateway shutting down by user request.")
     finally:
-        if GLOBAL_MODBUS_CLIENT:
-            GLOBAL_MODBUS_CLIENT.close()
-            logger.info("Modbus client connection closed.")
+        executor.shutdown(wait=True, cancel_futures=True) # Let running polls finish before closing their clients
+        CONTROL_EXECUTOR.shutdown(wait=True)
+        CONTROL_EXECUTOR = None
+        if mqtt_driver:
+            mqtt_driver.close() # Before wakeup_send closes: a finishing connect writes to it
+        wakeup_recv.close()
+        wakeup_send.close()
+        for link in MODBUS_LINK_POOL.values():
+            link.close()
+        logger.info("Modbus client connections closed.")
         if mqtt_client:
-            mqtt_client.loop_stop()
             mqtt_client.disconnect()
+            # DISCONNECT is only queued (see on_socket_register_write) and no network thread
+            # runs, so write it out; otherwise the broker sees a dropped connection
+            mqtt_client.loop_write()
             logger.info("MQTT client connection closed.")
+        if influx_lines is not None:
+            influx_lines.flush()
+        if influx_write_api:
+            influx_write_api.close() # Waits for pending writes
         if influx_client:
             influx_client.close()
             logger.info("InfluxDB client connection closed.")
@@ -409,17 +1023,18 @@ if __name__ == "__main__":
 
     if not load_gateway_config(args.config):
         exit(1)
+    SLAVES = parse_slave_configs(CONFIG)
 
-    modbus_conf = CONFIG.get('modbus_server', {})
     influx_conf = CONFIG.get('influxdb', {})
     mqtt_conf = CONFIG.get('mqtt', {})
 
-    # Initial Modbus connection attempt - result stored in GLOBAL_MODBUS_CLIENT by connect_modbus_client
-    initial_modbus_client = connect_modbus_client(modbus_conf.get('host'), modbus_conf.get('port'))
     influx_client = connect_influxdb_client(influx_conf.get('url'), influx_conf.get('token'), influx_conf.get('org'))
     mqtt_client = connect_mqtt_client(mqtt_conf.get('broker_host'), mqtt_conf.get('broker_port'), mqtt_conf.get('client_id', 'modbus_gateway_client'))
 
-    if not initial_modbus_client:
-        logger.warning("Initial Modbus connection failed. Main loop will attempt to reconnect.")
+    influx_write_api = create_influxdb_write_api(influx_client)
+
+    # docker stop sends SIGTERM; handle it like Ctrl+C so main_loop's cleanup flushes buffered points
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
 
-    main_loop(initial_modbus_client, influx_client, mqtt_client)
+    # Modbus connections are opened per slave by the main loop's first polls
+    main_loop(influx_client, mqtt_client, influx_write_api)
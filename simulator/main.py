@@ -1,174 +1,333 @@
 import argparse
-import yaml
+import asyncio
+import functools
+from dataclasses import dataclass
+import json
+import os
 import time
 import random
 import math
-from pymodbus.server import StartTcpServer
-from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
-from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer
+# yaml and pymodbus are imported where first needed: a config served from the JSON cache
+# never needs yaml, and --help or a bad config exits before pymodbus is imported
 
-# Global store for device configurations
-DEVICE_CONFIGS = {}
-# Global store for datastore
-DATASTORE = {}
+# The simulator's own generator for random trends
+_rng = random.Random()
 
-def load_config(config_file):
-    """Loads device configurations from a YAML file."""
-    global DEVICE_CONFIGS
+# Trend codes, resolved from the config's trend names once instead of compared per tick
+TREND_STATIC, TREND_LINEAR, TREND_RANDOM, TREND_SINUSOIDAL = range(4)
+_TREND_CODES = {'static': TREND_STATIC, 'linear': TREND_LINEAR, 'random': TREND_RANDOM, 'sinusoidal': TREND_SINUSOIDAL}
+
+def _config_cache_path(config_file):
+    return config_file + '.cache'
+
+# The cache is JSON, plain data only: whoever can write next to the config can at most
+# change the config, as they could by editing it, never run code when it's loaded.
+
+def _load_cached_config(config_file, stamp):
+    """Returns the parsed config cached next to config_file, or None if missing or stale."""
+    try:
+        with open(_config_cache_path(config_file), 'r') as f:
+            cached = json.load(f)
+        if tuple(cached['stamp']) != stamp:
+            return None
+        return cached['config']
+    except Exception: # Missing, unreadable or from an incompatible version: just reparse
+        return None
+
+def _write_config_cache(config_file, stamp, configs):
+    # YAML has more types than JSON (dates, integer keys, ...); a config using them isn't cached
+    try:
+        text = json.dumps({'stamp': stamp, 'config': configs})
+    except (TypeError, ValueError):
+        return
+    if json.loads(text) != {'stamp': list(stamp), 'config': configs}:
+        return
     try:
+        with open(_config_cache_path(config_file), 'w') as f:
+            f.write(text)
+    except OSError as e: # E.g. a read-only config mount; the cache is only an optimization
+        print(f"Could not write config cache for {config_file}: {e}")
+
+@functools.lru_cache(maxsize=8)
+def _parse_config(config_file, stamp):
+    """The parsed config of config_file as of stamp, from the JSON cache or the YAML."""
+    configs = _load_cached_config(config_file, stamp)
+    if configs is None:
+        try:
+            import pylibyaml # Optional: patches PyYAML's default loaders to use libyaml
+        except ImportError:
+            pass
+        import yaml
+        # libyaml's C parser when PyYAML was built with it; same safe semantics as yaml.safe_load
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
         with open(config_file, 'r') as f:
-            DEVICE_CONFIGS = yaml.safe_load(f)
+            try:
+                configs = yaml.load(f, Loader=loader)
+            except yaml.YAMLError as e: # Reported by load_config, which doesn't import yaml
+                raise ValueError(e) from e
+        _write_config_cache(config_file, stamp, configs)
+    return configs
+
+def load_config(config_file):
+    """Loads device configurations from a YAML file; returns None if it can't be used.
+
+    The parsed config is cached as JSON next to the file, keyed by the file's
+    modification time and size, so restarts with an unchanged config skip the YAML parse.
+    Within a process, loading the same unchanged file again returns the config already
+    parsed; it is shared, so it must not be modified.
+    """
+    try:
+        st = os.stat(config_file)
+        configs = _parse_config(config_file, (st.st_mtime_ns, st.st_size))
         print(f"Loaded configuration from {config_file}")
-        if not DEVICE_CONFIGS or 'devices' not in DEVICE_CONFIGS:
+        if not configs or 'devices' not in configs:
             print("Error: 'devices' key not found in configuration.")
-            DEVICE_CONFIGS = {'devices': []} # Ensure it's an empty list
-            return False
-        return True
+            return None
+        return configs
     except FileNotFoundError:
         print(f"Error: Configuration file {config_file} not found.")
-        DEVICE_CONFIGS = {'devices': []}
-        return False
-    except yaml.YAMLError as e:
+        return None
+    except ValueError as e:
         print(f"Error parsing YAML file {config_file}: {e}")
-        DEVICE_CONFIGS = {'devices': []}
-        return False
-
-
-def initialize_datastore():
-    """Initializes the Modbus datastore based on loaded configurations."""
-    global DATASTORE
-    global DEVICE_CONFIGS
-
-    if not DEVICE_CONFIGS.get('devices'):
+        return None
+
+
+# Trend kernels: each updates every register of one trend in the values read for a tick.
+# A group holds its registers' addresses and params, one list per field (indexed alike).
+# Params that default to the register's current value get their own kernel, so none
+# of the kernels branches per register. Values are kept to 16 bits, see register_value.
+
+def _linear_kernel(values, group, now):
+    addresses, slopes = group
+    for addr, slope in zip(addresses, slopes):
+        values[addr] = int(values[addr] + slope) & 0xFFFF
+
+def _random_kernel(values, group, now):
+    addresses, mins, spans = group
+    # random.uniform is Python code around random(); done inline it saves a call per register
+    rand = _rng.random
+    for addr, min_val, span in zip(addresses, mins, spans):
+        values[addr] = int(min_val + span * rand()) & 0xFFFF
+
+def _random_around_kernel(values, group, now):
+    """Random registers with a bound left to default to 5 around the current value (None)."""
+    addresses, mins, maxs = group
+    rand = _rng.random
+    for addr, min_val, max_val in zip(addresses, mins, maxs):
+        current_val = values[addr]
+        if min_val is None:
+            min_val = current_val - 5
+        if max_val is None:
+            max_val = current_val + 5
+        values[addr] = int(min_val + (max_val - min_val) * rand()) & 0xFFFF
+
+def _sinusoidal_kernel(values, group, now):
+    addresses, amplitudes, frequencies, offsets = group
+    sin = math.sin
+    for addr, amplitude, frequency, offset in zip(addresses, amplitudes, frequencies, offsets):
+        values[addr] = int(offset + amplitude * sin(frequency * now)) & 0xFFFF
+
+def _sinusoidal_around_kernel(values, group, now):
+    """Sinusoidal registers oscillating around their current value (no offset configured)."""
+    addresses, amplitudes, frequencies = group
+    sin = math.sin
+    for addr, amplitude, frequency in zip(addresses, amplitudes, frequencies):
+        values[addr] = int(values[addr] + amplitude * sin(frequency * now)) & 0xFFFF
+
+def _linear_trend(params):
+    return _linear_kernel, (params.get('slope', 1),)
+
+def _random_trend(params):
+    min_val = params.get('min')
+    max_val = params.get('max')
+    if min_val is None or max_val is None:
+        return _random_around_kernel, (min_val, max_val)
+    return _random_kernel, (min_val, max_val - min_val)
+
+def _sinusoidal_trend(params):
+    fields = (params.get('amplitude', 10), params.get('frequency', 0.1))
+    offset = params.get('offset')
+    if offset is None:
+        return _sinusoidal_around_kernel, fields
+    return _sinusoidal_kernel, fields + (offset,)
+
+# Trend -> function returning a register's kernel and group fields, given its params
+_TREND_KERNELS = {
+    TREND_LINEAR: _linear_trend,
+    TREND_RANDOM: _random_trend,
+    TREND_SINUSOIDAL: _sinusoidal_trend,
+}
+
+class RegisterTrends:
+    """A register type's trend updates, with its registers grouped by trend.
+
+    Built once from the config: each tick runs one kernel per trend over its group
+    instead of branching on every register's trend. Registers at or past readable, the
+    number of values the datastore block can return from address 0, are left out.
+    """
+    __slots__ = ('groups', 'window')
+
+    def __init__(self, reg_defs, readable):
+        groups = {}
+        addresses = []
+        for reg_def in reg_defs:
+            trend = _TREND_CODES.get(reg_def.get('trend', 'static'), TREND_STATIC)
+            if trend == TREND_STATIC:
+                continue
+            address = reg_def['address']
+            if address >= readable: # Past the end of the datastore block
+                continue
+            addresses.append(address)
+            kernel, fields = _TREND_KERNELS[trend](reg_def.get('params', {}))
+            row = (address,) + fields
+            group = groups.get(kernel)
+            if group is None:
+                group = groups[kernel] = tuple([] for _ in row)
+            for column, value in zip(group, row):
+                column.append(value)
+        self.groups = tuple(groups.items()) # ((kernel, group), ...)
+        # Registers 0 to the highest trended address, read and written back in one call per tick;
+        # static registers past it are never touched
+        # (so every trended address is within the values read)
+        self.window = max(addresses) + 1 if addresses else 0
+
+def register_value(value):
+    """Converts a value to a 16-bit register's contents, wrapping around like the register.
+
+    A value outside 0-65535 in the datastore (a sinusoid dipping below zero, a linear
+    trend running past the top) makes the server fail to encode any response that
+    includes it.
+    """
+    return int(value) & 0xFFFF
+
+# Config register type -> (ModbusSlaveContext block, value conversion)
+_REGISTER_TYPES = (
+    ('discrete_inputs', 'di', bool),
+    ('coils', 'co', bool),
+    ('holding_registers', 'hr', register_value),
+    ('input_registers', 'ir', register_value),
+)
+
+@dataclass(frozen=True)
+class SimulatorState:
+    """Everything the running simulator works on, built once from the config."""
+    __slots__ = ('devices', 'datastore', 'context', 'hr_trends', 'ir_trends')
+    devices: list
+    datastore: 'ModbusSlaveContext'
+    # Maps the slave contexts to slave IDs, served by the TCP server
+    context: 'ModbusServerContext'
+    hr_trends: RegisterTrends
+    ir_trends: RegisterTrends
+
+    @property
+    def dynamic(self):
+        """Whether any register follows a trend, i.e. whether ticks change anything."""
+        return bool(self.hr_trends.groups or self.ir_trends.groups)
+
+def initialize_datastore(devices):
+    """Initializes the Modbus datastore for the configured devices."""
+    from pymodbus.datastore import ModbusSequentialDataBlock, ModbusSlaveContext, ModbusServerContext
+
+    if not devices:
+        # Every block then gets the default size, with no values set
         print("No devices found in configuration. Initializing empty datastore.")
-        # Initialize with empty blocks if no devices are configured
-        DATASTORE = ModbusSlaveContext(
-            di=ModbusSequentialDataBlock(0, [False]*100), # Discrete Inputs
-            co=ModbusSequentialDataBlock(0, [False]*100), # Coils
-            hr=ModbusSequentialDataBlock(0, [0]*100),     # Holding Registers
-            ir=ModbusSequentialDataBlock(0, [0]*100)      # Input Registers
-        )
-        return
-
-    # Determine max addresses for each register type to size the blocks
-    # These are just examples, in a real scenario you'd calculate this more precisely
-    # or allow for dynamic sizing if the library supports it well.
-    # For simplicity here, using fixed large enough sizes or deriving from config.
-    max_coils = 0
-    max_discrete_inputs = 0
-    max_holding_registers = 0
-    max_input_registers = 0
 
-    for device in DEVICE_CONFIGS.get('devices', []):
+    # One pass over the devices collects each register type's definitions and the highest
+    # address, which sizes its block.
+    reg_defs = {reg_type: [] for reg_type, _, _ in _REGISTER_TYPES}
+    block_sizes = dict.fromkeys(reg_defs, 0)
+    for device in devices:
         registers = device.get('registers', {})
-        for reg_list in registers.get('coils', []):
-            max_coils = max(max_coils, reg_list.get('address', -1) + 1)
-        for reg_list in registers.get('discrete_inputs', []):
-            max_discrete_inputs = max(max_discrete_inputs, reg_list.get('address', -1) + 1)
-        for reg_list in registers.get('holding_registers', []):
-            max_holding_registers = max(max_holding_registers, reg_list.get('address', -1) + 1)
-        for reg_list in registers.get('input_registers', []):
-            max_input_registers = max(max_input_registers, reg_list.get('address', -1) + 1)
-
-    # Ensure minimum size of 1 if no registers of a type are defined
-    # Pymodbus DataBlock address 0, count N means addresses 0 to N-1
-    # So if max_coils is 0 (meaning no coils defined or highest addr is -1), count should be 0.
-    # But pymodbus might need at least 1 for block initialization.
-    # Let's default to 100 if 0, for safety, or you can make it 0 if pymodbus handles it.
-    
-    di_block = ModbusSequentialDataBlock(0, [False] * (max_discrete_inputs or 100))
-    co_block = ModbusSequentialDataBlock(0, [False] * (max_coils or 100))
-    hr_block = ModbusSequentialDataBlock(0, [0] * (max_holding_registers or 100))
-    ir_block = ModbusSequentialDataBlock(0, [0] * (max_input_registers or 100))
-
-    # Populate initial values
-    for device in DEVICE_CONFIGS.get('devices', []):
-        registers = device.get('registers', {})
-        for reg_def in registers.get('holding_registers', []):
-            hr_block.setValues(reg_def['address'], int(reg_def['value']))
-        for reg_def in registers.get('input_registers', []):
-            ir_block.setValues(reg_def['address'], int(reg_def['value']))
-        for reg_def in registers.get('coils', []):
-            co_block.setValues(reg_def['address'], bool(reg_def['value']))
-        for reg_def in registers.get('discrete_inputs', []):
-            di_block.setValues(reg_def['address'], bool(reg_def['value']))
-
-    DATASTORE = ModbusSlaveContext(di=di_block, co=co_block, hr=hr_block, ir=ir_block)
-
+        for reg_type, defs in reg_defs.items():
+            size = block_sizes[reg_type]
+            for reg_def in registers.get(reg_type, []):
+                defs.append(reg_def)
+                size = max(size, reg_def.get('address', -1) + 1)
+            block_sizes[reg_type] = size
+
+    # Pymodbus DataBlock address 0, count N means addresses 0 to N-1. A type with no
+    # registers defined still gets a block of 100, for safety. Each block is created from
+    # the complete list of initial values rather than filled in register by register.
+    blocks = {}
+    for reg_type, block_key, convert in _REGISTER_TYPES:
+        initial_values = [convert(0)] * (block_sizes[reg_type] or 100)
+        for reg_def in reg_defs[reg_type]:
+            initial_values[reg_def['address']] = convert(reg_def['value'])
+        blocks[block_key] = ModbusSequentialDataBlock(0, initial_values)
+
+    datastore = ModbusSlaveContext(**blocks)
+    # How many holding and input register values a read from address 0 returns, which
+    # bounds the trended addresses
+    hr_readable = len(datastore.getValues(3, 0, count=len(blocks['hr'].values)))
+    ir_readable = len(datastore.getValues(4, 0, count=len(blocks['ir'].values)))
+    # All configured registers belong to one register map, served under ID 0x01 and every
+    # device's configured address. The IDs share the one datastore object rather than each
+    # getting a copy of the blocks: a write through any of them is seen through all of them.
+    slave_ids = {0x01}
+    slave_ids.update(device['address'] for device in devices if 'address' in device)
+    context = ModbusServerContext(slaves=dict.fromkeys(slave_ids, datastore), single=False)
+    return SimulatorState(devices, datastore, context, RegisterTrends(reg_defs['holding_registers'], hr_readable),
+                          RegisterTrends(reg_defs['input_registers'], ir_readable))
+
+
+def _apply_trends(slave_context, function_code, trends, now):
+    """Updates one register type's registers (function code 3 or 4) from their trends at time now."""
+    if not trends.window:
+        return
+    # One read and one write for the whole range instead of a pair of calls per register
+    values = slave_context.getValues(function_code, 0, count=trends.window)
+    for kernel, group in trends.groups:
+        kernel(values, group, now)
+    slave_context.setValues(function_code, 0, values)
 
-def update_simulated_values(context):
+def update_simulated_values(state):
     """Updates register values based on simulation trends."""
-    global DEVICE_CONFIGS
-    if not DEVICE_CONFIGS or 'devices' not in DEVICE_CONFIGS:
+    if not state.dynamic: # All static: nothing to read, compute or write back
         return
-
-    for device in DEVICE_CONFIGS['devices']:
-        registers = device.get('registers', {})
-        
-        for reg_def in registers.get('holding_registers', []):
-            addr = reg_def['address']
-            current_val_list = context[0x01].getValues(3, addr, count=1) # slave_id=1, fc=3 (HR)
-            if not current_val_list: continue # Should not happen if initialized
-            current_val = current_val_list[0]
-
-            new_val = current_val
-            trend = reg_def.get('trend', 'static')
-            params = reg_def.get('params', {})
-
-            if trend == 'linear':
-                slope = params.get('slope', 1)
-                new_val = current_val + slope
-            elif trend == 'random':
-                min_val = params.get('min', current_val - 5)
-                max_val = params.get('max', current_val + 5)
-                new_val = random.uniform(min_val, max_val)
-            elif trend == 'sinusoidal':
-                amplitude = params.get('amplitude', 10)
-                frequency = params.get('frequency', 0.1)
-                offset = params.get('offset', current_val) # Offset around initial value or a specific one
-                new_val = offset + amplitude * math.sin(frequency * time.time())
-            
-            context[0x01].setValues(3, addr, [int(new_val)]) # FC3 for HR
-
-        # Similar logic for input_registers if they also need to be dynamic
-        for reg_def in registers.get('input_registers', []):
-            addr = reg_def['address']
-            current_val_list = context[0x01].getValues(4, addr, count=1) # FC4 for IR
-            if not current_val_list: continue
-            current_val = current_val_list[0]
-            
-            new_val = current_val
-            trend = reg_def.get('trend', 'static')
-            params = reg_def.get('params', {})
-
-            if trend == 'linear':
-                new_val = current_val + params.get('slope', 1)
-            elif trend == 'random':
-                new_val = random.uniform(params.get('min', current_val - 5), params.get('max', current_val + 5))
-            elif trend == 'sinusoidal':
-                new_val = params.get('offset', current_val) + params.get('amplitude', 10) * math.sin(params.get('frequency', 0.1) * time.time())
-            
-            context[0x01].setValues(4, addr, [int(new_val)]) # FC4 for IR
-        
-        # Coils and Discrete Inputs are typically not updated by trends in this manner,
-        # but can be toggled or set based on other logic if needed.
-
-
-def run_server(config_file, host, port):
+    datastore = state.datastore
+    # One clock read per tick: every sinusoid is evaluated at the same instant
+    # (the monotonic clock, unaffected by wall clock adjustments; read as integer ns, it is
+    # small enough since boot that freq * now keeps full precision)
+    now = time.monotonic_ns() * 1e-9
+    _apply_trends(datastore, 3, state.hr_trends, now) # FC3 for HR
+    _apply_trends(datastore, 4, state.ir_trends, now) # FC4 for IR
+    # Coils and Discrete Inputs are typically not updated by trends in this manner,
+    # but can be toggled or set based on other logic if needed.
+
+
+# How often the simulated register values move along their trends
+UPDATE_INTERVAL_S = 1.0
+
+async def _update_periodically(state):
+    """Advances the simulated values every UPDATE_INTERVAL_S, independently of client requests.
+
+    Ticks are scheduled against integer monotonic deadlines, so the time spent updating
+    doesn't add up into drift; ticks missed while the loop was held up are skipped.
+    """
+    interval_ns = int(UPDATE_INTERVAL_S * 1e9)
+    next_update_ns = time.monotonic_ns() + interval_ns
+    while True:
+        await asyncio.sleep(max(0, next_update_ns - time.monotonic_ns()) * 1e-9)
+        now_ns = time.monotonic_ns()
+        next_update_ns += interval_ns
+        if next_update_ns <= now_ns:
+            next_update_ns = now_ns + interval_ns
+        try:
+            update_simulated_values(state)
+        except Exception as e: # Keep simulating; one bad tick shouldn't stop the updates
+            print(f"Error updating simulated values: {e}")
+
+async def run_server(config_file, host, port):
     """Main function to run the Modbus TCP server."""
-    if not load_config(config_file):
+    configs = load_config(config_file)
+    if configs is None:
         print("Failed to load configuration. Exiting.")
         return
 
-    initialize_datastore()
-    
-    # The ModbusServerContext maps slave contexts to slave IDs.
-    # For a single slave device, we can map it to ID 0x01 or any other.
-    # If your config supports multiple slave IDs on the same IP/port, you'd iterate here.
-    # For now, assuming all configured registers belong to a single slave unit (e.g., ID 1)
-    context = ModbusServerContext(slaves={0x01: DATASTORE}, single=False)
+    from pymodbus.server import StartAsyncTcpServer
+    from pymodbus.device import ModbusDeviceIdentification
 
+    state = initialize_datastore(configs['devices'] or [])
 
     identity = ModbusDeviceIdentification()
     identity.VendorName = 'Pymodbus'
@@ -180,38 +339,21 @@ def run_server(config_file, host, port):
 
     print(f"Starting Modbus TCP server on {host}:{port}")
 
-    # Start the server in a new thread or use asyncio variant for non-blocking updates
-    # For simplicity, using StartTcpServer which is blocking.
-    # For data updates, you'd typically run the update_simulated_values in a separate thread/task.
-    
-    # Quick and dirty way to update values periodically alongside a blocking server
-    # This is NOT ideal for production. Proper way is threaded updates or asyncio server.
-    class UpdatingServerContext:
-        def __init__(self, server_context):
-            self.server_context = server_context
-            self.last_update_time = time.time()
-
-        def __getitem__(self, slave_id):
-            # Update values if 1 second has passed
-            if time.time() - self.last_update_time > 1.0:
-                # print("Updating simulated values...")
-                update_simulated_values(self.server_context)
-                self.last_update_time = time.time()
-            return self.server_context[slave_id]
-
-        def __setitem__(self, key, value):
-            self.server_context[key] = value
-
-
-    updating_context = UpdatingServerContext(context)
-
-    StartTcpServer(
-        context=updating_context,  # use the custom context
-        identity=identity,
-        address=(host, port),
-        # framer=ModbusRtuFramer, # For RTU over TCP
-        # framer=ModbusAsciiFramer, # For ASCII over TCP
-    )
+    # The values are updated from a task on the server's event loop, so requests are
+    # served straight from the datastore and updates run whether or not clients poll.
+    # With only static registers there is nothing to update.
+    updater = asyncio.create_task(_update_periodically(state)) if state.dynamic else None
+    try:
+        await StartAsyncTcpServer(
+            context=state.context,
+            identity=identity,
+            address=(host, port),
+            # framer=ModbusRtuFramer, # For RTU over TCP (from pymodbus.transaction)
+            # framer=ModbusAsciiFramer, # For ASCII over TCP (from pymodbus.transaction)
+        )
+    finally:
+        if updater is not None:
+            updater.cancel()
 
 
 if __name__ == "__main__":
@@ -236,4 +378,4 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    run_server(args.config, args.host, args.port) 
\ No newline at end of file
+    asyncio.run(run_server(args.config, args.host, args.port)) 
\ No newline at end of file